@@ -0,0 +1,123 @@
+"""A script to report recall and latency of IVF index against exact search
+
+Usage:
+    python -m benchmarks.ann_recall <domain> [--nlist 0 256 1024] [--nprobe 1 4 8 16 32]
+
+Queries are stored chunk vectors with added noise, so the report can be made
+without calling embeddings API. The chunks queries are made from are left out
+of the searched vectors. nlist 0 means the default number of clusters.
+"""
+
+import argparse
+import time
+import numpy as np
+from src.chatbot_core.ivf_index import IVFIndex
+from src.chatbot_core.retriever import VectorRetriever, normalize_rows
+from src.data_collection.embedding_store import EmbeddingStore
+
+
+def make_queries(vectors, n_queries, noise, groups=None, seed=0):
+    """A method to create query vectors near random stored vectors, held out of search
+
+    Chunks the queries are made from, and with groups every chunk of their
+    group, are left out of the rows to search. Otherwise a query finds the
+    chunk it was made from first, which overstates recall.
+
+    Args:
+        vectors (numpy array): Stored chunk vectors
+        n_queries (int): Number of queries
+        noise (float): Standard deviation of noise added to every dimension
+        groups (array like, optional): Group of every chunk, e.g. its page. Defaults to None.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        tuple: Unit length query vectors and sorted rows to search
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(
+        rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    )
+    queries = np.asarray(vectors[rows], dtype=np.float32)
+    queries = queries + rng.normal(0, noise, queries.shape).astype(np.float32)
+    if groups is None:
+        held_out = np.isin(np.arange(len(vectors)), rows)
+    else:
+        groups = np.asarray(groups)
+        held_out = np.isin(groups, groups[rows])
+    return normalize_rows(queries), np.flatnonzero(~held_out)
+
+
+def timed_search(retriever, queries, k, exact):
+    """A method to run queries and measure latency
+
+    Args:
+        retriever (VectorRetriever): Retriever to search
+        queries (numpy array): Query vectors
+        k (int): Number of results per query
+        exact (bool): Score all chunks
+
+    Returns:
+        tuple: Results of every query and latencies in milliseconds
+    """
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(retriever.top_k(query, k, exact=exact))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+
+def main():
+    """A method to print recall vs latency table"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("domain", help="Website domain, e.g. www.example.com")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--nlist", type=int, nargs="+", default=[0])
+    parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32]
+    )
+    args = parser.parse_args()
+
+    index = EmbeddingStore(args.domain).load()
+    queries, rows = make_queries(index.vectors, args.queries, args.noise)
+    vectors = np.asarray(index.vectors[rows], dtype=np.float32)
+    n_tokens = index.metadata["n_tokens"].values[rows]
+
+    exact = VectorRetriever(vectors, n_tokens)
+    truth, latencies = timed_search(exact, queries, args.k, exact=True)
+    print(f"chunks={len(vectors)} k={args.k} queries={len(queries)}")
+    print(
+        f"exact: p50={np.percentile(latencies, 50):.2f}ms "
+        f"p95={np.percentile(latencies, 95):.2f}ms"
+    )
+    print("nlist\tnprobe\trecall\tp50_ms\tp95_ms\tbuild_s")
+
+    for nlist in args.nlist:
+        start = time.perf_counter()
+        ann_index = IVFIndex.build(vectors, nlist=nlist or None)
+        build_time = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            retriever = VectorRetriever(
+                vectors, n_tokens, ann_index=ann_index, nprobe=nprobe
+            )
+            results, latencies = timed_search(
+                retriever, queries, args.k, exact=False
+            )
+            recall = np.mean(
+                [
+                    len(np.intersect1d(found, expected)) / len(expected)
+                    for found, expected in zip(results, truth)
+                ]
+            )
+            print(
+                f"{ann_index.nlist}\t{nprobe}\t{recall:.3f}\t"
+                f"{np.percentile(latencies, 50):.2f}\t"
+                f"{np.percentile(latencies, 95):.2f}\t{build_time:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""A script to measure chatbot server throughput as concurrent clients increase
+
+Usage:
+    python -m benchmarks.load_test https://www.example.com [https://www.other.com ...]
+        [--server http://localhost:5000] [--clients 1 2 4 8 16] [--requests 50]
+
+Clients pick websites round robin, so several websites are queried at the same
+time. Websites should be indexed before running the test.
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+
+QUESTIONS = [
+    "What does this website offer?",
+    "How can I contact you?",
+    "What is the pricing?",
+    "What is the refund policy?",
+]
+
+
+def ask(server, website, question):
+    """A method to send one question and measure its latency
+
+    Args:
+        server (str): Chatbot server URL
+        website (str): Website to ask about
+        question (str): A user query
+
+    Returns:
+        float: Latency in milliseconds
+    """
+    start = time.perf_counter()
+    response = requests.get(
+        server + "/get",
+        params={"msg": question, "websiteName": website},
+        timeout=120,
+    )
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+def run_level(server, websites, clients, n_requests):
+    """A method to send requests with a number of concurrent clients
+
+    Args:
+        server (str): Chatbot server URL
+        websites (list): Websites to ask about
+        clients (int): Number of concurrent clients
+        n_requests (int): Total number of requests
+
+    Returns:
+        tuple: Requests per second and latencies in milliseconds
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = list(
+            executor.map(
+                lambda i: ask(
+                    server,
+                    websites[i % len(websites)],
+                    QUESTIONS[i % len(QUESTIONS)],
+                ),
+                range(n_requests),
+            )
+        )
+    return n_requests / (time.perf_counter() - start), np.array(latencies)
+
+
+def main():
+    """A method to print throughput and latency for every concurrency level"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("websites", nargs="+")
+    parser.add_argument("--server", default="http://localhost:5000")
+    parser.add_argument(
+        "--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16]
+    )
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    print("clients\treq_per_s\tp50_ms\tp95_ms")
+    for clients in args.clients:
+        throughput, latencies = run_level(
+            args.server, args.websites, clients, args.requests
+        )
+        print(
+            f"{clients}\t{throughput:.2f}\t\t"
+            f"{np.percentile(latencies, 50):.0f}\t"
+            f"{np.percentile(latencies, 95):.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
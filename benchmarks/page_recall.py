@@ -0,0 +1,85 @@
+"""A script to report recall, latency and scoring work of page by page search against exact search
+
+Usage:
+    python -m benchmarks.page_recall <domain> [--nprobe 16 32 64 128 256]
+
+Queries are stored chunk vectors with added noise, so the report can be made
+without calling embeddings API. The pages queries are made from are left out of
+the searched vectors, so the page of a query is not simply probed first. Scored
+rows are page centroids plus chunks of the nprobe closest pages, exact search
+scores every chunk.
+"""
+
+import argparse
+import time
+import numpy as np
+from benchmarks.ann_recall import make_queries, timed_search
+from src.chatbot_core.ivf_index import IVFIndex
+from src.chatbot_core.retriever import VectorRetriever
+from src.data_collection.embedding_store import EmbeddingStore
+
+
+def main():
+    """A method to print recall vs scoring work table"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("domain", help="Website domain, e.g. www.example.com")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[16, 32, 64, 128, 256]
+    )
+    args = parser.parse_args()
+
+    index = EmbeddingStore(args.domain).load()
+    queries, rows = make_queries(
+        index.vectors,
+        args.queries,
+        args.noise,
+        groups=index.metadata["file"].values,
+    )
+    vectors = np.asarray(index.vectors[rows], dtype=np.float32)
+    n_tokens = index.metadata["n_tokens"].values[rows]
+    files = index.metadata["file"].values[rows]
+
+    exact = VectorRetriever(vectors, n_tokens)
+    truth, latencies = timed_search(exact, queries, args.k, exact=True)
+    start = time.perf_counter()
+    page_index = IVFIndex.from_groups(vectors, files)
+    build_time = time.perf_counter() - start
+    print(
+        f"chunks={len(vectors)} pages={page_index.nlist} k={args.k} "
+        f"queries={len(queries)} build_s={build_time:.1f}"
+    )
+    print(
+        f"exact: scored_rows={len(vectors)} "
+        f"p50={np.percentile(latencies, 50):.2f}ms "
+        f"p95={np.percentile(latencies, 95):.2f}ms"
+    )
+    print("nprobe\trecall\tscored_rows\tp50_ms\tp95_ms")
+
+    for nprobe in args.nprobe:
+        retriever = VectorRetriever(
+            vectors, n_tokens, ann_index=page_index, nprobe=nprobe
+        )
+        results, latencies = timed_search(
+            retriever, queries, args.k, exact=False
+        )
+        recall = np.mean(
+            [
+                len(np.intersect1d(found, expected)) / len(expected)
+                for found, expected in zip(results, truth)
+            ]
+        )
+        scored_rows = page_index.nlist + np.mean(
+            [len(page_index.candidates(query, nprobe)) for query in queries]
+        )
+        print(
+            f"{nprobe}\t{recall:.3f}\t{scored_rows:.0f}\t"
+            f"{np.percentile(latencies, 50):.2f}\t"
+            f"{np.percentile(latencies, 95):.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
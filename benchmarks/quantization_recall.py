@@ -0,0 +1,69 @@
+"""A script to report recall, latency and memory of quantized vectors against exact search
+
+Usage:
+    python -m benchmarks.quantization_recall <domain> [--types int8] [--rescore 0 2 4 8]
+
+Queries are stored chunk vectors with added noise, so the report can be made
+without calling embeddings API. The chunks queries are made from are left out
+of the searched vectors. rescore 0 means ranking by quantized scores only.
+"""
+
+import argparse
+import numpy as np
+from benchmarks.ann_recall import make_queries, timed_search
+from src.chatbot_core.quantization import QuantizedVectors
+from src.chatbot_core.retriever import VectorRetriever
+from src.data_collection.embedding_store import EmbeddingStore
+
+
+def main():
+    """A method to print recall vs memory table"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("domain", help="Website domain, e.g. www.example.com")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--types", nargs="+", default=["int8"])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[0, 2, 4, 8])
+    args = parser.parse_args()
+
+    index = EmbeddingStore(args.domain).load()
+    queries, rows = make_queries(index.vectors, args.queries, args.noise)
+    vectors = np.asarray(index.vectors[rows], dtype=np.float32)
+    n_tokens = index.metadata["n_tokens"].values[rows]
+
+    exact = VectorRetriever(vectors, n_tokens)
+    truth, latencies = timed_search(exact, queries, args.k, exact=True)
+    print(f"chunks={len(vectors)} k={args.k} queries={len(queries)}")
+    print(
+        f"float32: memory={vectors.nbytes / 2**20:.1f}MB "
+        f"p50={np.percentile(latencies, 50):.2f}ms "
+        f"p95={np.percentile(latencies, 95):.2f}ms"
+    )
+    print("type\trescore\trecall\tp50_ms\tp95_ms\tmemory_mb")
+
+    for dtype in args.types:
+        quantized = QuantizedVectors.quantize(vectors, dtype)
+        for rescore in args.rescore:
+            retriever = VectorRetriever(
+                vectors, n_tokens, quantized=quantized, rescore=rescore
+            )
+            results, latencies = timed_search(
+                retriever, queries, args.k, exact=False
+            )
+            recall = np.mean(
+                [
+                    len(np.intersect1d(found, expected)) / len(expected)
+                    for found, expected in zip(results, truth)
+                ]
+            )
+            print(
+                f"{dtype}\t{rescore}\t{recall:.3f}\t"
+                f"{np.percentile(latencies, 50):.2f}\t"
+                f"{np.percentile(latencies, 95):.2f}\t"
+                f"{quantized.nbytes / 2**20:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
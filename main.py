@@ -2,7 +2,15 @@
 
 """
 
-from flask import Flask, render_template, request
+import json
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+)
 from src.nlp_core import NLPCore
 
 
@@ -26,9 +34,69 @@ def get_bot_response():
     """
     user_text = request.args.get("msg")
     website_name = request.args.get("websiteName")
-    nlp_core.set_website_name(website_name)
-    return str(nlp_core.core_method(user_text))
+    return str(nlp_core.core_method(user_text, website_name))
+
+
+@app.route("/stream")
+def stream_bot_response():
+    """A method to stream bot response as Server-Sent Events
+
+    Every piece of the response is sent as a JSON encoded "data" event while
+    the model writes it, followed by a "done" event.
+
+    Returns:
+        Response : An event stream of bot response pieces
+    """
+    user_text = request.args.get("msg")
+    website_name = request.args.get("websiteName")
+
+    def events():
+        for piece in nlp_core.stream_method(user_text, website_name):
+            yield "data: " + json.dumps(piece) + "\n\n"
+        yield "event: done\ndata: \n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/index")
+def start_indexing():
+    """A method to start indexing a website in background
+
+    Returns:
+        json : Indexing status and progress of the website
+    """
+    website_name = request.args.get("websiteName")
+    if not nlp_core.is_indexed(website_name):
+        nlp_core.start_indexing(website_name)
+    return jsonify(nlp_core.indexing_status(website_name))
+
+
+@app.route("/status")
+def get_indexing_status():
+    """A method to get indexing status of a website, polled by the UI
+
+    Returns:
+        json : Indexing status and progress of the website
+    """
+    website_name = request.args.get("websiteName")
+    return jsonify(nlp_core.indexing_status(website_name))
+
+
+@app.route("/stats")
+def get_stats():
+    """A method to get cache counters of the server
+
+    Returns:
+        json : Hits, misses and evictions of index, query and answer caches
+    """
+    return jsonify(nlp_core.cache_stats())
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0")
+    # Requests are served by concurrent threads, blocking openai calls of one
+    # request do not hold up requests of other users
+    app.run(host="0.0.0.0", threaded=True)
@@ -0,0 +1,187 @@
+"""A module to reuse answers of near-duplicate questions asked about a website
+
+Questions are compared by cosine similarity of their embeddings. Answers of a
+website are dropped when its index version changes, i.e. the index is rebuilt.
+Only websites listed in answer_cache_websites are cached, as questions naming
+different products or people can be as similar as rephrased questions.
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.utility.utils import config
+from src.utility import constants
+from src.chatbot_core.retriever import normalize_query
+
+
+class DomainAnswers:
+    """A class to hold cached questions and answers of one website"""
+
+    def __init__(self, version, max_entries, dimensions) -> None:
+        """A class constructor
+
+        Args:
+            version (str): Version of the website index the answers are based on
+            max_entries (int): Maximum number of answers kept
+            dimensions (int): Size of question embeddings
+        """
+        self.version = version
+        self.vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self.answers = [None] * max_entries
+        self.size = 0
+        # Slot replaced next once the cache is full(oldest answer)
+        self.next_slot = 0
+
+    def lookup(self, query_vector, threshold):
+        """A method to find answer of the most similar cached question
+
+        Args:
+            query_vector (numpy array): Unit length question embedding
+            threshold (float): Minimum cosine similarity
+
+        Returns:
+            str: Cached answer, None if no question is similar enough
+        """
+        if self.size == 0:
+            return None
+        scores = self.vectors[: self.size] @ query_vector
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        return self.answers[best]
+
+    def add(self, query_vector, answer):
+        """A method to cache an answer, replacing the oldest one when full
+
+        Args:
+            query_vector (numpy array): Unit length question embedding
+            answer (str): Bot answer
+        """
+        self.vectors[self.next_slot] = query_vector
+        self.answers[self.next_slot] = answer
+        self.size = max(self.size, self.next_slot + 1)
+        self.next_slot = (self.next_slot + 1) % len(self.answers)
+
+
+class AnswerCache:
+    """A thread-safe cache of answers per website"""
+
+    def __init__(
+        self, threshold, max_entries, max_domains, websites=()
+    ) -> None:
+        """A class constructor
+
+        Args:
+            threshold (float): Minimum similarity of questions to reuse an answer
+            max_entries (int): Maximum cached answers of a website
+            max_domains (int): Maximum websites kept, least recently used are dropped
+            websites (iterable, optional): Domain names of websites whose answers are cached. Defaults to none.
+        """
+        self.websites = frozenset(websites)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_domains = max_domains
+        self.hits = 0
+        self.misses = 0
+        self._domains = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enabled(self, domain):
+        """A method to check if answers of a website are cached
+
+        Args:
+            domain (str): Website domain name
+
+        Returns:
+            bool: True if domain is in websites
+        """
+        return domain in self.websites
+
+    def lookup(self, domain, version, query_vector):
+        """A method to get cached answer of a near-duplicate question
+
+        Args:
+            domain (str): Website domain name
+            version (str): Version of the website index
+            query_vector (array like): Question embedding
+
+        Returns:
+            str: Cached answer, None on a miss or if the website is not cached
+        """
+        if not self.enabled(domain):
+            return None
+        query_vector = normalize_query(query_vector)
+        with self._lock:
+            answers = self._domains.get(domain)
+            answer = None
+            if answers is not None:
+                if answers.version != version:
+                    # Index was rebuilt, answers may be outdated
+                    del self._domains[domain]
+                else:
+                    self._domains.move_to_end(domain)
+                    answer = answers.lookup(query_vector, self.threshold)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def store(self, domain, version, query_vector, answer):
+        """A method to cache answer of a question
+
+        Args:
+            domain (str): Website domain name
+            version (str): Version of the website index
+            query_vector (array like): Question embedding
+            answer (str): Bot answer
+        """
+        if not self.enabled(domain):
+            return
+        query_vector = normalize_query(query_vector)
+        with self._lock:
+            answers = self._domains.get(domain)
+            if answers is None or answers.version != version:
+                answers = DomainAnswers(
+                    version, self.max_entries, len(query_vector)
+                )
+                self._domains[domain] = answers
+            self._domains.move_to_end(domain)
+            answers.add(query_vector, answer)
+            while len(self._domains) > self.max_domains:
+                self._domains.popitem(last=False)
+
+    def invalidate(self, domain):
+        """A method to drop all cached answers of a website
+
+        Args:
+            domain (str): Website domain name
+        """
+        with self._lock:
+            self._domains.pop(domain, None)
+
+    def stats(self):
+        """A method to get hit and miss counters
+
+        Returns:
+            dict: Hits, misses and number of cached websites
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "domains": len(self._domains),
+            }
+
+
+# Cache shared by all ChatbotCore instances
+answer_cache = AnswerCache(
+    float(config.get(constants.ANSWER_CACHE_THRESHOLD)),
+    int(config.get(constants.ANSWER_CACHE_SIZE)),
+    int(config.get(constants.ANSWER_CACHE_DOMAINS)),
+    [
+        website.strip()
+        for website in config.get(constants.ANSWER_CACHE_WEBSITES).split(",")
+        if website.strip()
+    ],
+)
@@ -0,0 +1,212 @@
+"""A module for a BM25 inverted index over chunk texts
+
+Every term of the website points to the chunks containing it, with the BM25
+weight of the term in the chunk computed at build time. A query is scored by
+adding idf * weight over the chunks of its terms, without any embedding.
+"""
+
+import sys
+from collections import Counter
+import numpy as np
+from src.utility.nlp_text_cleaner import split_into_terms
+
+
+# BM25 term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+# Changed when texts are split into terms differently, older indexes are built again
+TERMS_VERSION = 2
+
+
+class BM25Index:
+    """A class for inverted index with BM25 scores"""
+
+    def __init__(
+        self,
+        terms,
+        offsets,
+        rows,
+        weights,
+        n_chunks,
+        terms_version=TERMS_VERSION,
+    ) -> None:
+        """A class constructor
+
+        Args:
+            terms (list): Terms, position is term number
+            offsets (numpy array): Start of postings of every term in rows, plus the end
+            rows (numpy array): Chunk row numbers ordered by term
+            weights (numpy array): BM25 weight of the term in every chunk of rows
+            n_chunks (int): Number of chunks
+            terms_version (int, optional): Way texts were split into terms. Defaults to TERMS_VERSION.
+        """
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.terms_version = terms_version
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+        self.n_chunks = n_chunks
+        document_frequency = np.diff(offsets)
+        self.idf = np.log(
+            1
+            + (n_chunks - document_frequency + 0.5)
+            / (document_frequency + 0.5)
+        ).astype(np.float32)
+        # Term strings are shared by the list and the dict
+        self.terms_nbytes = (
+            sys.getsizeof(self.terms)
+            + sys.getsizeof(self.term_ids)
+            + sum(sys.getsizeof(term) for term in terms)
+        )
+
+    @property
+    def nbytes(self):
+        """Bytes of terms, postings and idf arrays"""
+        return (
+            self.terms_nbytes
+            + self.offsets.nbytes
+            + self.rows.nbytes
+            + self.weights.nbytes
+            + self.idf.nbytes
+        )
+
+    @classmethod
+    def build(cls, text_batches, k1=K1, b=B):
+        """A method to build the index from chunk texts
+
+        Args:
+            text_batches (iterable): Lists of chunk texts in row order
+            k1 (float, optional): Term frequency saturation. Defaults to 1.2.
+            b (float, optional): Length normalization. Defaults to 0.75.
+
+        Returns:
+            BM25Index: Index over the texts
+        """
+        term_ids = {}
+        batch_terms = []
+        batch_rows = []
+        batch_counts = []
+        lengths = []
+        for texts in text_batches:
+            terms, rows, counts = [], [], []
+            for text in texts:
+                words = split_into_terms(text)
+                for term, count in Counter(words).items():
+                    terms.append(term_ids.setdefault(term, len(term_ids)))
+                    rows.append(len(lengths))
+                    counts.append(count)
+                lengths.append(len(words))
+            batch_terms.append(np.array(terms, dtype=np.int32))
+            batch_rows.append(np.array(rows, dtype=np.int32))
+            batch_counts.append(np.array(counts, dtype=np.float32))
+
+        terms = (
+            np.concatenate(batch_terms)
+            if batch_terms
+            else np.empty(0, np.int32)
+        )
+        rows = (
+            np.concatenate(batch_rows) if batch_rows else np.empty(0, np.int32)
+        )
+        counts = (
+            np.concatenate(batch_counts)
+            if batch_counts
+            else np.empty(0, np.float32)
+        )
+        lengths = np.array(lengths, dtype=np.float32)
+        average_length = (
+            lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        )
+
+        weights = (counts * (k1 + 1)) / (
+            counts + k1 * (1 - b + b * lengths[rows] / average_length)
+        )
+        order = np.argsort(terms, kind="stable")
+        offsets = np.searchsorted(
+            terms[order], np.arange(len(term_ids) + 1), side="left"
+        )
+        return cls(
+            list(term_ids),
+            offsets,
+            rows[order],
+            weights[order].astype(np.float32),
+            len(lengths),
+        )
+
+    def scores(self, query):
+        """A method to get BM25 score of every chunk for a query
+
+        Args:
+            query (str): User query
+
+        Returns:
+            numpy array: Score of each chunk, 0 for chunks without query terms
+        """
+        scores = np.zeros(self.n_chunks, dtype=np.float32)
+        for term in set(split_into_terms(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # A chunk appears once in postings of a term
+            scores[self.rows[start:end]] += (
+                self.idf[term_id] * self.weights[start:end]
+            )
+        return scores
+
+    def top_k(self, query, k):
+        """A method to get chunks with highest BM25 scores, best first
+
+        Args:
+            query (str): User query
+            k (int): Number of chunks to return
+
+        Returns:
+            numpy array: Row numbers of at most k chunks containing query terms
+        """
+        scores = self.scores(query)
+        matches = np.flatnonzero(scores > 0)
+        k = min(k, len(matches))
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+        best = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        return best[np.argsort(-scores[best], kind="stable")]
+
+    def save(self, path):
+        """A method to save the index to a npz file
+
+        Args:
+            path (str): File path
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.array("\n".join(self.terms)),
+                offsets=self.offsets,
+                rows=self.rows,
+                weights=self.weights,
+                n_chunks=np.array(self.n_chunks),
+                terms_version=np.array(self.terms_version),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """A method to load the index from a npz file
+
+        Args:
+            path (str): File path
+
+        Returns:
+            BM25Index: Stored index
+        """
+        with np.load(path) as data:
+            terms = str(data["terms"])
+            return cls(
+                terms.split("\n") if terms else [],
+                data["offsets"],
+                data["rows"],
+                data["weights"],
+                int(data["n_chunks"]),
+                int(data["terms_version"]) if "terms_version" in data else 1,
+            )
@@ -1,12 +1,116 @@
 """A module to access and generate openai apis responses"""
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import openai
-from openai.embeddings_utils import distances_from_embeddings
+from src.chatbot_core.retriever import (
+    RETRIEVAL_HYBRID,
+    RETRIEVAL_LEXICAL,
+    RETRIEVAL_VECTOR,
+    VectorRetriever,
+    reciprocal_rank_fusion,
+)
+from src.chatbot_core.query_embedding_cache import query_embedding_cache
+from src.chatbot_core.answer_cache import answer_cache
 from src.utility.utils import config
 from src.utility import constants
 from src.utility.loggers import logger
 
 
+# Phrases in a reply without context which mean website context is needed
+NEGATIVE_RESPONSES = [
+    "I don't know",
+    "AI language model",
+    "I don't know.",
+    "I do not know",
+    "sorry",
+]
+
+
+# Ways to answer a question with gpt-3.5-turbo, chosen before calling the model
+ROUTE_CONTEXT = "context"
+ROUTE_SPECULATIVE = "speculative"
+ROUTE_SEQUENTIAL = "sequential"
+
+# Threads running answers with and without context at the same time
+_route_executor = ThreadPoolExecutor(
+    max_workers=int(config.get(constants.ROUTE_WORKERS)),
+    thread_name_prefix="route",
+)
+
+
+def is_negative_response(response_message):
+    """A method to check if a reply means the model did not know the answer
+
+    Args:
+        response_message (str): A model reply
+
+    Returns:
+        bool: True if reply contains a negative response phrase
+    """
+    return any(ele in response_message for ele in NEGATIVE_RESPONSES)
+
+
+def context_prompt(question, context):
+    """A method to create chat message content asking to answer from a context
+
+    Args:
+        question (str): A user query
+        context (str): Website text related to the query
+
+    Returns:
+        str: Message content
+    """
+    return f"Answer the question based on the context below, and if the question can't be answered based on the context, say \"I don't know\" and nothing else \n\n Context: {context}\n\n---\n\nQuestion: {question}\n Answer:"
+
+
+def completion_prompt(question, context):
+    """A method to create completion prompt asking to answer from a context
+
+    Args:
+        question (str): A user query
+        context (str): Website text related to the query
+
+    Returns:
+        str: Completion prompt
+    """
+    return f"Answer the question based on the context below, and if the question can't be answered based on the context, say \"I don't know\"\n\nContext: {context}\n\n---\n\nQuestion: {question}\nAnswer:"
+
+
+class ReplyStream:
+    """A class to iterate pieces of a streamed model reply"""
+
+    def __init__(self, response) -> None:
+        """A class constructor
+
+        Args:
+            response (iterator): Streamed chat completion chunks
+        """
+        self.response = response
+
+    def __iter__(self):
+        for chunk in self.response:
+            if chunk["choices"][0]["delta"].get("content"):
+                yield chunk["choices"][0]["delta"]["content"]
+
+    def close(self):
+        """A method to stop reading the reply, e.g. once another reply is used"""
+        close = getattr(self.response, "close", None)
+        if close is not None:
+            close()
+        # Releasing the response closes its connection
+        self.response = iter(())
+
+
+def close_stream(future):
+    """A method to close a reply stream started by stream_with_context once it is not used
+
+    Args:
+        future (Future): Future of stream_with_context
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result()[1].close()
+
+
 class ChatbotCore:
     """A class for chatgpt/openai API access"""
 
@@ -20,43 +124,268 @@ class ChatbotCore:
             },
         ]
         self.model = config.get(constants.CHAT_MODEL)
+        self.retrieval_threshold = float(
+            config.get(constants.ROUTE_RETRIEVAL_THRESHOLD)
+        )
+        self.speculative = config.get(constants.ROUTE_SPECULATIVE) == "true"
+        self.retrieval_mode = config.get(constants.RETRIEVAL_MODE)
+
+    def create_context(
+        self,
+        question,
+        index,
+        max_len=1800,
+        size="ada",
+        mode=None,
+        vector_rows=None,
+    ):
+        """
+        Create a context for a question by finding the most similar context from the index
+
+        mode is vector(embedding similarity), lexical(BM25, no embedding request)
+        or hybrid(reciprocal rank fusion of both), retrieval_mode by default.
+        vector_rows are chunks already retrieved by embedding, e.g. by route.
+        """
+        mode = mode or self.retrieval_mode
+        if index.lexical_index is None:
+            mode = RETRIEVAL_VECTOR
+        retriever = VectorRetriever.for_index(index)
+        k = retriever.context_size(max_len)
+
+        rows = []
+        if mode == RETRIEVAL_LEXICAL:
+            rows = index.lexical_index.top_k(question, k)
+        # Questions without any term of the website are matched by embeddings
+        if len(rows) == 0:
+            rows = vector_rows
+            if rows is None:
+                # Get the embeddings for the question, repeated questions are served from cache
+                q_embeddings = query_embedding_cache.get_or_create(question)
+                rows = retriever.top_k(q_embeddings, k)
+            if mode == RETRIEVAL_HYBRID:
+                rows = reciprocal_rank_fusion(
+                    [rows, index.lexical_index.top_k(question, k)]
+                )
+
+        # Keep the best chunks which fit in max_len
+        rows = retriever.pack(rows, max_len)
+        # Only texts of selected chunks are decompressed
+        returns = index.chunk_texts(rows)
+
+        # Return the context
+        return "\n\n###\n\n".join(returns)
 
-    def create_context(self, question, df, max_len=1800, size="ada"):
+    def query_vector(self, question):
+        """A method to get embedding of a question for routing, also used by answer cache
+
+        Args:
+            question (str): A user query
+
+        Returns:
+            numpy array: Question embedding, None in lexical retrieval mode so no embedding is requested
         """
-        Create a context for a question by finding the most similar context from the dataframe
+        if self.retrieval_mode == RETRIEVAL_LEXICAL:
+            return None
+        return query_embedding_cache.get_or_create(question)
+
+    def route(self, index, query_vector, max_len):
+        """A method to decide up front how to answer a question
+
+        A question very similar to some website text is answered from website
+        context right away. Other questions are either answered with and without
+        context at the same time(speculative), or first without context and
+        then with context if the model does not know the answer(sequential).
+        Chunks retrieved for the similarity check are returned to build the
+        context from, so they are not retrieved twice.
+
+        Args:
+            index (EmbeddingIndex): Context text chunks and embeddings
+            query_vector (numpy array): Question embedding, None to skip the similarity check
+            max_len (int): A maximum context length
+
+        Returns:
+            tuple: One of context, speculative or sequential, and chunks most similar to the question or None
         """
+        rows = None
+        if query_vector is not None:
+            retriever = VectorRetriever.for_index(index)
+            rows = retriever.top_k(
+                query_vector, retriever.context_size(max_len)
+            )
+            score = retriever.top_score(query_vector, rows)
+            logger.info("Top retrieval score: %.3f", score)
+            if score >= self.retrieval_threshold:
+                return ROUTE_CONTEXT, rows
+        if self.speculative:
+            return ROUTE_SPECULATIVE, rows
+        return ROUTE_SEQUENTIAL, rows
 
-        # Get the embeddings for the question
-        q_embeddings = openai.Embedding.create(
-            input=question, engine="text-embedding-ada-002"
-        )["data"][0]["embedding"]
+    def direct_messages(self, question):
+        """A method to get chat messages asking a question without context
+
+        Args:
+            question (str): A user query
+
+        Returns:
+            list: Chat messages
+        """
+        return self.chat_messages + [{"role": "user", "content": question}]
 
-        # Get the distances from the embeddings
-        df["distances"] = distances_from_embeddings(
-            q_embeddings, df["embeddings"].values, distance_metric="cosine"
+    def context_messages(
+        self, question, index, max_len, size, vector_rows=None
+    ):
+        """A method to get chat messages asking a question with website context
+
+        Args:
+            question (str): A user query
+            index (EmbeddingIndex): Context text chunks and embeddings
+            max_len (int): A maximum context length
+            size (str): Size
+            vector_rows (numpy array, optional): Chunks already retrieved by embedding. Defaults to None.
+
+        Returns:
+            list: Chat messages
+        """
+        context = self.create_context(
+            question,
+            index,
+            max_len=max_len,
+            size=size,
+            vector_rows=vector_rows,
         )
+        # logger.info("Context:\n" + context)
+        return self.direct_messages(question) + [
+            {"role": "user", "content": context_prompt(question, context)}
+        ]
 
-        returns = []
-        cur_len = 0
+    def complete_chat(self, messages):
+        """A method to get reply of chat model
 
-        # Sort by distance and add the text to the context until the context is too long
-        for i, row in df.sort_values("distances", ascending=True).iterrows():
-            # Add the length of the text to the current length
-            cur_len += row["n_tokens"] + 4
+        Args:
+            messages (list): Chat messages
 
-            # If the context is too long, break
-            if cur_len > max_len:
-                break
+        Returns:
+            str: Model reply
+        """
+        response = openai.ChatCompletion.create(
+            model=self.model,
+            messages=messages,
+        )
+        return response["choices"][0]["message"]["content"]
 
-            # Else add it to the text that is being returned
-            returns.append(row["text"])
+    def stream_chat(self, messages):
+        """A method to get reply of chat model piece by piece
 
-        # Return the context
-        return "\n\n###\n\n".join(returns)
+        The request is sent right away, pieces are read from the returned
+        iterator as the model writes them.
+
+        Args:
+            messages (list): Chat messages
+
+        Returns:
+            ReplyStream: Pieces of model reply
+        """
+        response = openai.ChatCompletion.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+        )
+        return ReplyStream(response)
+
+    def stream_with_context(
+        self, question, index, max_len, size, vector_rows=None
+    ):
+        """A method to start streaming reply to a question with website context
+
+        Args:
+            question (str): A user query
+            index (EmbeddingIndex): Context text chunks and embeddings
+            max_len (int): A maximum context length
+            size (str): Size
+            vector_rows (numpy array, optional): Chunks already retrieved by embedding. Defaults to None.
+
+        Returns:
+            tuple: Chat messages and ReplyStream of reply pieces
+        """
+        messages = self.context_messages(
+            question, index, max_len, size, vector_rows
+        )
+        return messages, self.stream_chat(messages)
+
+    def answer_speculatively(
+        self, question, index, max_len, size, vector_rows=None
+    ):
+        """A method to ask a question with and without context at the same time
+
+        The first reply which is not a negative response is used. If both are
+        negative, the reply with context is used. A failing request is only
+        raised if the other one fails too.
+
+        Args:
+            question (str): A user query
+            index (EmbeddingIndex): Context text chunks and embeddings
+            max_len (int): A maximum context length
+            size (str): Size
+            vector_rows (numpy array, optional): Chunks already retrieved by embedding. Defaults to None.
+
+        Returns:
+            tuple: Chat messages of the used reply and the reply
+        """
+        direct_messages = self.direct_messages(question)
+        direct = _route_executor.submit(self.complete_chat, direct_messages)
+        contextual = _route_executor.submit(
+            self.answer_with_context,
+            question,
+            index,
+            max_len,
+            size,
+            vector_rows,
+        )
+
+        pending = {direct, contextual}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if (
+                direct in done
+                and direct.exception() is None
+                and not is_negative_response(direct.result())
+            ):
+                # Reply with context is not requested if it has not started yet
+                contextual.cancel()
+                return direct_messages, direct.result()
+            if (
+                contextual in done
+                and contextual.exception() is None
+                and not is_negative_response(contextual.result()[1])
+            ):
+                return contextual.result()
+        if contextual.exception() is not None and direct.exception() is None:
+            return direct_messages, direct.result()
+        return contextual.result()
+
+    def answer_with_context(
+        self, question, index, max_len, size, vector_rows=None
+    ):
+        """A method to ask a question with website context
+
+        Args:
+            question (str): A user query
+            index (EmbeddingIndex): Context text chunks and embeddings
+            max_len (int): A maximum context length
+            size (str): Size
+            vector_rows (numpy array, optional): Chunks already retrieved by embedding. Defaults to None.
+
+        Returns:
+            tuple: Chat messages and the reply
+        """
+        messages = self.context_messages(
+            question, index, max_len, size, vector_rows
+        )
+        return messages, self.complete_chat(messages)
 
     def answer_question(
         self,
-        df,
+        index,
         question,
         max_len=1800,
         size="ada",
@@ -67,7 +396,7 @@ class ChatbotCore:
         """A method to return response of chatbot based on model selected
 
         Args:
-            df (pandas dataframe): Context text embeddings
+            index (EmbeddingIndex): Context text chunks and embeddings
             moel (str, optional): A chatbot model either gpt-3.5-turbo or text-davinci-003 . Defaults to "text-davinci-003".
             max_len (int, optional): A maximum context length. Defaults to 1800.
             size (str, optional): Size. Defaults to "ada".
@@ -80,59 +409,57 @@ class ChatbotCore:
         """
 
         try:
-            if self.model == "gpt-3.5-turbo":
-                self.chat_messages.append(
-                    {"role": "user", "content": question}
+            # Near-duplicate questions about the same website reuse the cached answer
+            query_vector = self.query_vector(question)
+            cached_answer = None
+            if query_vector is not None:
+                cached_answer = answer_cache.lookup(
+                    index.domain, index.version, query_vector
                 )
-                response = openai.ChatCompletion.create(
-                    model=self.model,
-                    messages=self.chat_messages,
-                )
-                response_message = response["choices"][0]["message"]["content"]
-                negative_responses = [
-                    "I don't know",
-                    "AI language model",
-                    "I don't know.",
-                    "I do not know",
-                    "sorry",
-                ]
-                if any(ele in response_message for ele in negative_responses):
-                    # Answer a question based on the most similar context from the dataframe texts
+            if cached_answer is not None:
+                logger.info("Answer served from cache")
+                return cached_answer
 
-                    context = self.create_context(
-                        question,
-                        df,
-                        max_len=max_len,
-                        size=size,
-                    )
-                    # logger.info("Context:\n" + context)
-
-                    self.chat_messages.append(
-                        {
-                            "role": "user",
-                            "content": f"Answer the question based on the context below, and if the question can't be answered based on the context, say \"I don't know\" and nothing else \n\n Context: {context}\n\n---\n\nQuestion: {question}\n Answer:",
-                        }
-                    )
-                    response = openai.ChatCompletion.create(
-                        model=self.model,
-                        messages=self.chat_messages,
+            if self.model == "gpt-3.5-turbo":
+                route, rows = self.route(index, query_vector, max_len)
+                if route == ROUTE_CONTEXT:
+                    messages, response_message = self.answer_with_context(
+                        question, index, max_len, size, rows
                     )
-                    response_message = response["choices"][0]["message"][
-                        "content"
-                    ]
-                    self.chat_messages.append(
-                        {"role": "assistant", "content": response_message}
+                elif route == ROUTE_SPECULATIVE:
+                    messages, response_message = self.answer_speculatively(
+                        question, index, max_len, size, rows
                     )
                 else:
-                    self.chat_messages.append(
-                        {"role": "assistant", "content": response_message}
-                    )
+                    messages = self.direct_messages(question)
+                    response_message = self.complete_chat(messages)
+                    if is_negative_response(response_message):
+                        # Answer a question based on the most similar context from the index texts
+                        messages, response_message = self.answer_with_context(
+                            question, index, max_len, size, rows
+                        )
+                self.chat_messages = messages + [
+                    {"role": "assistant", "content": response_message}
+                ]
 
+                if response_message and query_vector is not None:
+                    answer_cache.store(
+                        index.domain,
+                        index.version,
+                        query_vector,
+                        response_message,
+                    )
                 return response_message
             elif self.model == "text-davinci-003":
+                context = self.create_context(
+                    question,
+                    index,
+                    max_len=max_len,
+                    size=size,
+                )
                 # Create a completions using the questin and context
                 response = openai.Completion.create(
-                    prompt=f"Answer the question based on the context below, and if the question can't be answered based on the context, say \"I don't know\"\n\nContext: {context}\n\n---\n\nQuestion: {question}\nAnswer:",
+                    prompt=completion_prompt(question, context),
                     temperature=0,
                     max_tokens=max_tokens,
                     top_p=1,
@@ -142,7 +469,129 @@ class ChatbotCore:
                     model=self.model,
                 )
                 # print(response["choices"][0]["text"].strip())
-                return response["choices"][0]["text"].strip()
+                response_message = response["choices"][0]["text"].strip()
+                if response_message and query_vector is not None:
+                    answer_cache.store(
+                        index.domain,
+                        index.version,
+                        query_vector,
+                        response_message,
+                    )
+                return response_message
         except Exception as e:
             logger.error(e)
             return ""
+
+    def stream_answer(
+        self,
+        index,
+        question,
+        max_len=1800,
+        size="ada",
+        max_tokens=150,
+        stop_sequence=None,
+    ):
+        """A method to generate response of chatbot piece by piece as the model writes it
+
+        Questions are routed as in answer_question. A reply without context is
+        only sent once it is known not to be a negative response, a reply with
+        context is streamed token by token.
+
+        Args:
+            index (EmbeddingIndex): Context text chunks and embeddings
+            max_len (int, optional): A maximum context length. Defaults to 1800.
+            size (str, optional): Size. Defaults to "ada".
+            max_tokens (int, optional): maximum tokens ina query. Defaults to 150.
+            stop_sequence (_type_, optional): Where to stop bot response. Defaults to None.
+
+        Yields:
+            str: Next piece of bot response
+        """
+        try:
+            query_vector = self.query_vector(question)
+            cached_answer = None
+            if query_vector is not None:
+                cached_answer = answer_cache.lookup(
+                    index.domain, index.version, query_vector
+                )
+            if cached_answer is not None:
+                logger.info("Answer served from cache")
+                yield cached_answer
+                return
+
+            pieces = []
+            if self.model == "gpt-3.5-turbo":
+                route, rows = self.route(index, query_vector, max_len)
+                contextual = None
+                if route == ROUTE_SPECULATIVE:
+                    # Start streaming reply with context while asking without it
+                    contextual = _route_executor.submit(
+                        self.stream_with_context,
+                        question,
+                        index,
+                        max_len,
+                        size,
+                        rows,
+                    )
+                if route != ROUTE_CONTEXT:
+                    messages = self.direct_messages(question)
+                    try:
+                        response_message = self.complete_chat(messages)
+                    except Exception as e:
+                        if contextual is None:
+                            raise
+                        # Reply with context is used if asking without it fails
+                        logger.error(e)
+                        response_message = None
+                    if (
+                        response_message is not None
+                        and not is_negative_response(response_message)
+                    ):
+                        if contextual is not None and not contextual.cancel():
+                            # Reply with context is not used, stop it
+                            contextual.add_done_callback(close_stream)
+                        pieces.append(response_message)
+                        yield response_message
+                if not pieces:
+                    if contextual is not None:
+                        messages, stream = contextual.result()
+                    else:
+                        messages, stream = self.stream_with_context(
+                            question, index, max_len, size, rows
+                        )
+                    for piece in stream:
+                        pieces.append(piece)
+                        yield piece
+                self.chat_messages = messages + [
+                    {"role": "assistant", "content": "".join(pieces)}
+                ]
+            elif self.model == "text-davinci-003":
+                context = self.create_context(
+                    question,
+                    index,
+                    max_len=max_len,
+                    size=size,
+                )
+                for chunk in openai.Completion.create(
+                    prompt=completion_prompt(question, context),
+                    temperature=0,
+                    max_tokens=max_tokens,
+                    top_p=1,
+                    frequency_penalty=0,
+                    presence_penalty=0,
+                    stop=stop_sequence,
+                    model=self.model,
+                    stream=True,
+                ):
+                    piece = chunk["choices"][0]["text"]
+                    if piece:
+                        pieces.append(piece)
+                        yield piece
+
+            response_message = "".join(pieces).strip()
+            if response_message and query_vector is not None:
+                answer_cache.store(
+                    index.domain, index.version, query_vector, response_message
+                )
+        except Exception as e:
+            logger.error(e)
@@ -0,0 +1,200 @@
+"""A module for an approximate nearest neighbour(IVF) index over chunk embeddings
+
+Chunks are grouped into clusters with spherical k-means. A query is scored
+against cluster centroids first and then only against chunks of the nprobe
+closest clusters. More clusters(nlist) or fewer probes(nprobe) give lower
+latency and lower recall.
+"""
+
+import numpy as np
+
+
+# Rows scored at once while assigning chunks to clusters
+ASSIGN_BATCH_SIZE = 16384
+
+
+def default_nlist(n_vectors):
+    """A method to get number of clusters for a number of vectors
+
+    Args:
+        n_vectors (int): Number of vectors in the index
+
+    Returns:
+        int: Number of clusters
+    """
+    return max(1, min(n_vectors, int(4 * np.sqrt(n_vectors))))
+
+
+def assign_to_centroids(vectors, centroids):
+    """A method to find closest centroid of every vector
+
+    Args:
+        vectors (numpy array): Unit length vectors, one per row
+        centroids (numpy array): Unit length centroids, one per row
+
+    Returns:
+        numpy array: Centroid number of every vector
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        batch = np.asarray(vectors[start : start + ASSIGN_BATCH_SIZE])
+        assignments[start : start + len(batch)] = np.argmax(
+            batch @ centroids.T, axis=1
+        )
+    return assignments
+
+
+class IVFIndex:
+    """A class for inverted file index with cosine similarity"""
+
+    def __init__(self, centroids, rows, offsets) -> None:
+        """A class constructor
+
+        Args:
+            centroids (numpy array): Unit length cluster centroids
+            rows (numpy array): Chunk row numbers ordered by cluster
+            offsets (numpy array): Start of every cluster in rows, plus the end
+        """
+        self.centroids = centroids
+        self.rows = rows
+        self.offsets = offsets
+
+    @property
+    def nlist(self):
+        """Number of clusters"""
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, nlist=None, n_iter=10, sample_size=None, seed=0):
+        """A method to cluster vectors and build the index
+
+        Args:
+            vectors (numpy array): Unit length vectors, one per row
+            nlist (int, optional): Number of clusters. Defaults to 4*sqrt(n).
+            n_iter (int, optional): K-means iterations. Defaults to 10.
+            sample_size (int, optional): Vectors used for training. Defaults to 256*nlist.
+            seed (int, optional): Random seed. Defaults to 0.
+
+        Returns:
+            IVFIndex: Index over the vectors
+        """
+        n_vectors = len(vectors)
+        nlist = min(nlist or default_nlist(n_vectors), n_vectors)
+        sample_size = min(sample_size or 256 * nlist, n_vectors)
+        rng = np.random.default_rng(seed)
+
+        sample = np.asarray(
+            vectors[
+                np.sort(rng.choice(n_vectors, sample_size, replace=False))
+            ],
+            dtype=np.float32,
+        )
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignments, kind="stable")
+            starts = np.searchsorted(assignments[order], np.arange(nlist))
+            filled = np.bincount(assignments, minlength=nlist) > 0
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], starts[filled])
+            norms = np.linalg.norm(sums, axis=1)
+            # Keep old centroid for empty clusters
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, np.newaxis]
+
+        assignments = assign_to_centroids(vectors, centroids)
+        rows = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(
+            assignments[rows], np.arange(nlist + 1), side="left"
+        )
+        return cls(centroids, rows, offsets)
+
+    @classmethod
+    def from_groups(cls, vectors, groups):
+        """A method to build the index with a cluster for every group of vectors
+
+        E.g. with chunks grouped by page, a query is scored against page
+        centroids first and then only against chunks of the nprobe closest pages.
+
+        Args:
+            vectors (numpy array): Unit length vectors, one per row
+            groups (array like): Group of every vector, e.g. its page
+
+        Returns:
+            IVFIndex: Index with normalized mean of every group as centroid
+        """
+        _, assignments = np.unique(
+            np.asarray(groups).astype(str), return_inverse=True
+        )
+        nlist = int(assignments.max()) + 1 if len(assignments) else 0
+
+        sums = np.zeros((nlist, vectors.shape[1]), dtype=np.float32)
+        for start in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+            batch = np.asarray(
+                vectors[start : start + ASSIGN_BATCH_SIZE], dtype=np.float32
+            )
+            batch_assignments = assignments[start : start + len(batch)]
+            order = np.argsort(batch_assignments, kind="stable")
+            present, starts = np.unique(
+                batch_assignments[order], return_index=True
+            )
+            sums[present] += np.add.reduceat(batch[order], starts)
+        norms = np.linalg.norm(sums, axis=1)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms[:, np.newaxis]
+
+        rows = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(
+            assignments[rows], np.arange(nlist + 1), side="left"
+        )
+        return cls(centroids, rows, offsets)
+
+    def candidates(self, query_vector, nprobe):
+        """A method to get rows of chunks in clusters closest to the query
+
+        Args:
+            query_vector (numpy array): Unit length query embedding
+            nprobe (int): Number of clusters to search
+
+        Returns:
+            numpy array: Row numbers of candidate chunks
+        """
+        nprobe = min(nprobe, self.nlist)
+        centroid_scores = self.centroids @ query_vector
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.nlist)
+        return np.concatenate(
+            [
+                self.rows[self.offsets[probe] : self.offsets[probe + 1]]
+                for probe in probes
+            ]
+        )
+
+    def save(self, path):
+        """A method to save the index to a npz file
+
+        Args:
+            path (str): File path
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                rows=self.rows,
+                offsets=self.offsets,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """A method to load the index from a npz file
+
+        Args:
+            path (str): File path
+
+        Returns:
+            IVFIndex: Stored index
+        """
+        with np.load(path) as data:
+            return cls(data["centroids"], data["rows"], data["offsets"])
@@ -0,0 +1,128 @@
+"""A module to project website embeddings to fewer dimensions for a first search pass
+
+A principal component analysis(PCA) of the chunk vectors of a website gives
+the directions in which they differ most. Chunks and queries are projected on
+the first of these directions, so most of their similarity is kept in a
+fraction of the 1536 dimensions. The best candidates are rescored with the
+full vectors.
+"""
+
+import numpy as np
+
+
+# Vectors used to fit the projection
+FIT_SAMPLE_SIZE = 20000
+# Rows projected at a time
+PROJECT_BATCH_SIZE = 16384
+
+
+class PCAProjection:
+    """A class to hold a projection of a website and its projected chunk vectors"""
+
+    def __init__(self, mean, components, vectors) -> None:
+        """A class constructor
+
+        Args:
+            mean (numpy array): Mean of website vectors
+            components (numpy array): Projection matrix, one column per reduced dimension
+            vectors (numpy array): Projected chunk vectors, one row per chunk
+        """
+        self.mean = mean
+        self.components = components
+        self.vectors = vectors
+
+    @property
+    def dimensions(self):
+        """Number of reduced dimensions"""
+        return self.components.shape[1]
+
+    @property
+    def nbytes(self):
+        """Bytes of projection and projected vectors"""
+        return self.mean.nbytes + self.components.nbytes + self.vectors.nbytes
+
+    @classmethod
+    def fit(cls, vectors, dimensions, sample_size=FIT_SAMPLE_SIZE, seed=0):
+        """A method to fit a projection to vectors and project them
+
+        Args:
+            vectors (numpy array): Unit length vectors, one row per chunk
+            dimensions (int): Number of reduced dimensions
+            sample_size (int, optional): Vectors used to fit the projection. Defaults to 20000.
+            seed (int, optional): Random seed. Defaults to 0.
+
+        Returns:
+            PCAProjection: Projection with projected vectors
+        """
+        n_vectors = len(vectors)
+        dimensions = min(dimensions, vectors.shape[1])
+        sample_size = min(sample_size, n_vectors)
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(
+            vectors[
+                np.sort(rng.choice(n_vectors, sample_size, replace=False))
+            ],
+            dtype=np.float64,
+        )
+
+        mean = sample.mean(axis=0)
+        sample -= mean
+        # Eigenvectors of covariance matrix, largest eigenvalues first
+        _, eigenvectors = np.linalg.eigh(sample.T @ sample)
+        components = np.ascontiguousarray(
+            eigenvectors[:, ::-1][:, :dimensions], dtype=np.float32
+        )
+        mean = mean.astype(np.float32)
+
+        projected = np.empty((n_vectors, dimensions), dtype=np.float32)
+        for start in range(0, n_vectors, PROJECT_BATCH_SIZE):
+            block = np.asarray(
+                vectors[start : start + PROJECT_BATCH_SIZE], dtype=np.float32
+            )
+            projected[start : start + PROJECT_BATCH_SIZE] = (
+                block - mean
+            ) @ components
+        return cls(mean, components, projected)
+
+    def scores(self, query_vector, rows=None):
+        """A method to get approximate similarity of query with chunks
+
+        Scores differ from cosine similarity by query . mean, which is the same
+        for all chunks, so they rank chunks in the same order.
+
+        Args:
+            query_vector (numpy array): Unit length float32 query embedding
+            rows (numpy array, optional): Row numbers to score. Defaults to all rows.
+
+        Returns:
+            numpy array: Approximate similarity of each chunk
+        """
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        return vectors @ (query_vector @ self.components)
+
+    def save(self, path):
+        """A method to save projection and projected vectors to a .npz file
+
+        Args:
+            path (str): File path
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                mean=self.mean,
+                components=self.components,
+                vectors=self.vectors,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """A method to load projection and projected vectors from a .npz file
+
+        Args:
+            path (str): File path
+
+        Returns:
+            PCAProjection: Loaded projection
+        """
+        with np.load(path) as saved:
+            return cls(saved["mean"], saved["components"], saved["vectors"])
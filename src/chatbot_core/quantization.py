@@ -0,0 +1,126 @@
+"""A module to keep compact, quantized copies of website embeddings in memory
+
+int8 quarters the memory of float32 vectors. Values are scaled per dimension,
+so dimensions with small values keep their precision. The float32 vectors stay
+memory-mapped on disk to rescore the best candidates. float16 is not offered,
+as numpy converts it to float32 several times slower than a float32 scan.
+"""
+
+import numpy as np
+
+
+QUANTIZATION_TYPES = ("int8",)
+# Rows quantized at a time
+QUANTIZE_BATCH_SIZE = 16384
+# Rows converted to float32 at a time when scoring, small enough to stay in CPU cache
+SCORE_BATCH_SIZE = 256
+
+
+class QuantizedVectors:
+    """A class to hold a quantized embedding matrix and score queries against it"""
+
+    def __init__(self, data, scales=None) -> None:
+        """A class constructor
+
+        Args:
+            data (numpy array): An int8 matrix with one row per chunk
+            scales (numpy array, optional): Scale of every dimension of data. Defaults to None.
+        """
+        self.data = data
+        self.scales = scales
+        self.dtype = data.dtype.name
+
+    @classmethod
+    def quantize(cls, vectors, dtype):
+        """A method to quantize a float32 matrix
+
+        Args:
+            vectors (numpy array): Unit length vectors, one row per chunk
+            dtype (str): int8
+
+        Returns:
+            QuantizedVectors: Quantized vectors
+        """
+        if dtype not in QUANTIZATION_TYPES:
+            raise ValueError("Unknown quantization type " + dtype)
+
+        n_dims = vectors.shape[1] if vectors.ndim == 2 else 0
+        max_values = np.zeros(n_dims, dtype=np.float32)
+        for start in range(0, len(vectors), QUANTIZE_BATCH_SIZE):
+            block = np.abs(
+                np.asarray(
+                    vectors[start : start + QUANTIZE_BATCH_SIZE],
+                    dtype=np.float32,
+                )
+            )
+            max_values = np.maximum(max_values, block.max(axis=0))
+        scales = np.where(max_values > 0, max_values / 127, 1.0).astype(
+            np.float32
+        )
+
+        data = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, len(vectors), QUANTIZE_BATCH_SIZE):
+            block = np.asarray(
+                vectors[start : start + QUANTIZE_BATCH_SIZE], dtype=np.float32
+            )
+            data[start : start + QUANTIZE_BATCH_SIZE] = np.clip(
+                np.rint(block / scales), -127, 127
+            )
+        return cls(data, scales)
+
+    @property
+    def nbytes(self):
+        """Bytes of quantized data and scales"""
+        return self.data.nbytes + (
+            self.scales.nbytes if self.scales is not None else 0
+        )
+
+    def scores(self, query_vector, rows=None):
+        """A method to get approximate similarity of query with chunks
+
+        Args:
+            query_vector (numpy array): Unit length float32 query embedding
+            rows (numpy array, optional): Row numbers to score. Defaults to all rows.
+
+        Returns:
+            numpy array: Approximate similarity of each chunk
+        """
+        # Scores of int8 rows are q . (scales * query), as vectors ~ q * scales
+        if self.scales is not None:
+            query_vector = query_vector * self.scales
+        data = self.data if rows is None else self.data[rows]
+
+        scores = np.empty(len(data), dtype=np.float32)
+        for start in range(0, len(data), SCORE_BATCH_SIZE):
+            scores[start : start + SCORE_BATCH_SIZE] = (
+                data[start : start + SCORE_BATCH_SIZE].astype(np.float32)
+                @ query_vector
+            )
+        return scores
+
+    def save(self, path):
+        """A method to save quantized vectors to a .npz file
+
+        Args:
+            path (str): File path
+        """
+        with open(path, "wb") as f:
+            if self.scales is None:
+                np.savez(f, data=self.data)
+            else:
+                np.savez(f, data=self.data, scales=self.scales)
+
+    @classmethod
+    def load(cls, path):
+        """A method to load quantized vectors from a .npz file
+
+        Args:
+            path (str): File path
+
+        Returns:
+            QuantizedVectors: Loaded vectors
+        """
+        with np.load(path) as saved:
+            return cls(
+                saved["data"], saved["scales"] if "scales" in saved else None
+            )
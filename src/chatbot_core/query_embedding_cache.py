@@ -0,0 +1,211 @@
+"""A module to cache embeddings of user questions
+
+Embeddings are kept in an in-memory LRU tier and optionally in a sqlite file
+which survives restarts. Entries older than the TTL are not used, and are
+deleted from the file together with the oldest entries above its size limit.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from src.utility.utils import config
+from src.utility import constants
+from src.data_collection.embedding_client import EMBEDDING_MODEL, embed_batch
+
+
+# Inserts into the sqlite file between deletes of expired and oldest entries
+PRUNE_INTERVAL = 100
+
+
+def normalize_question(question):
+    """A method to normalize question text used as cache key
+
+    Args:
+        question (str): A user query
+
+    Returns:
+        str: Lower case question without extra whitespaces and trailing punctuation
+    """
+    question = " ".join(question.lower().split())
+    return re.sub(r"[\s?.!]+$", "", question)
+
+
+class QueryEmbeddingCache:
+    """A class to cache question embeddings keyed by normalized text and model"""
+
+    def __init__(
+        self, max_entries, ttl, disk_path=None, disk_max_entries=0
+    ) -> None:
+        """A class constructor
+
+        Args:
+            max_entries (int): Maximum entries of in-memory tier
+            ttl (float): Seconds an embedding stays valid, 0 for no expiry
+            disk_path (str, optional): sqlite file of on-disk tier. Defaults to None.
+            disk_max_entries (int, optional): Maximum entries of on-disk tier, 0 for no limit. Defaults to 0.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self._inserts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, created REAL, embedding BLOB)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS query_embeddings_created "
+                "ON query_embeddings (created)"
+            )
+            self._db.commit()
+            self._prune_disk()
+
+    def is_fresh(self, created):
+        """A method to check if an entry created at a time is within TTL
+
+        Args:
+            created (float): Entry creation time
+
+        Returns:
+            bool: True if entry can be used
+        """
+        return not self.ttl or time.time() - created < self.ttl
+
+    def get(self, question, model=EMBEDDING_MODEL):
+        """A method to get cached embedding of a question
+
+        Args:
+            question (str): A user query
+            model (str, optional): Embedding model. Defaults to text-embedding-ada-002.
+
+        Returns:
+            numpy array: Question embedding, None if not cached
+        """
+        key = model + "\n" + normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.is_fresh(entry[0]):
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, embedding FROM query_embeddings WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and self.is_fresh(row[0]):
+                    embedding = np.frombuffer(row[1], dtype=np.float32)
+                    self._put_memory(key, row[0], embedding)
+                    self.disk_hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, question, embedding, model=EMBEDDING_MODEL):
+        """A method to cache embedding of a question
+
+        Args:
+            question (str): A user query
+            embedding (array like): Question embedding
+            model (str, optional): Embedding model. Defaults to text-embedding-ada-002.
+        """
+        key = model + "\n" + normalize_question(question)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        created = time.time()
+        with self._lock:
+            self._put_memory(key, created, embedding)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                    (key, created, embedding.tobytes()),
+                )
+                self._db.commit()
+                self._inserts += 1
+                if self._inserts % PRUNE_INTERVAL == 0:
+                    self._prune_disk()
+
+    def _prune_disk(self):
+        """A method to delete expired entries and oldest entries above disk_max_entries
+
+        Space of deleted rows is reused by later inserts.
+        """
+        if self.ttl:
+            self._db.execute(
+                "DELETE FROM query_embeddings WHERE created < ?",
+                (time.time() - self.ttl,),
+            )
+        if self.disk_max_entries:
+            self._db.execute(
+                "DELETE FROM query_embeddings WHERE key IN "
+                "(SELECT key FROM query_embeddings "
+                "ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.disk_max_entries,),
+            )
+        self._db.commit()
+
+    def _put_memory(self, key, created, embedding):
+        self._entries[key] = (created, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_create(self, question, model=EMBEDDING_MODEL):
+        """A method to get question embedding from cache or embeddings API
+
+        Args:
+            question (str): A user query
+            model (str, optional): Embedding model. Defaults to text-embedding-ada-002.
+
+        Returns:
+            numpy array: Question embedding
+        """
+        embedding = self.get(question, model)
+        if embedding is None:
+            embedding = np.asarray(
+                embed_batch([question])[0], dtype=np.float32
+            )
+            self.put(question, embedding, model)
+        return embedding
+
+    def stats(self):
+        """A method to get hit rate metrics of the cache
+
+        Returns:
+            dict: Hits of each tier, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    (self.memory_hits + self.disk_hits) / lookups
+                    if lookups
+                    else 0.0
+                ),
+                "entries": len(self._entries),
+            }
+
+
+# Cache shared by all ChatbotCore instances
+query_embedding_cache = QueryEmbeddingCache(
+    int(config.get(constants.QUERY_CACHE_SIZE)),
+    float(config.get(constants.QUERY_CACHE_TTL)),
+    disk_path=config.get(constants.QUERY_CACHE_PATH) or None,
+    disk_max_entries=int(config.get(constants.QUERY_CACHE_DISK_SIZE)),
+)
@@ -0,0 +1,280 @@
+"""A module to retrieve most similar text chunks of a website for a query
+"""
+
+import threading
+import numpy as np
+from src.utility.utils import config
+from src.utility import constants
+
+
+# Tokens added for the separator between two chunks in a context
+SEPARATOR_TOKENS = 4
+# Ways to find chunks of a context, set by retrieval_mode
+RETRIEVAL_VECTOR = "vector"
+RETRIEVAL_LEXICAL = "lexical"
+RETRIEVAL_HYBRID = "hybrid"
+# Rank constant of reciprocal rank fusion, larger flattens the weight of top ranks
+RRF_K = 60
+
+_build_lock = threading.Lock()
+
+
+def normalize_rows(vectors):
+    """A method to scale vectors to unit length
+
+    Vectors which are already normalized are returned as they are, so a
+    memory-mapped matrix is not copied.
+
+    Args:
+        vectors (numpy array): A matrix with one vector per row
+
+    Returns:
+        numpy array: A float32 matrix with unit length rows
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return vectors
+    norms = np.linalg.norm(vectors, axis=1)
+    if np.allclose(norms, 1.0, atol=1e-3):
+        return vectors
+    norms[norms == 0] = 1.0
+    return vectors / norms[:, np.newaxis]
+
+
+def normalize_query(query_vector):
+    """A method to scale a query embedding to unit length
+
+    Args:
+        query_vector (array like): Query embedding
+
+    Returns:
+        numpy array: A float32 unit length vector
+    """
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    norm = np.linalg.norm(query_vector)
+    if norm > 0:
+        query_vector = query_vector / norm
+    return query_vector
+
+
+def top_rows(scores, k):
+    """A method to get positions of the k highest scores, best first
+
+    Args:
+        scores (numpy array): Similarity scores
+        k (int): Number of positions to return
+
+    Returns:
+        numpy array: Positions of the highest scores
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """A method to merge rankings of chunks by sum of 1 / (k + rank)
+
+    Args:
+        rankings (list): Row numbers of chunks, best first, one array per ranking
+        k (int, optional): Rank constant. Defaults to 60.
+
+    Returns:
+        numpy array: Row numbers in all rankings, best fused score first
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank + 1)
+    return np.array(
+        sorted(fused, key=lambda row: fused[row], reverse=True), dtype=np.int64
+    )
+
+
+class VectorRetriever:
+    """A class to score all chunks of a website with one matrix-vector product"""
+
+    def __init__(
+        self,
+        vectors,
+        n_tokens,
+        ann_index=None,
+        nprobe=8,
+        quantized=None,
+        rescore=4,
+        projection=None,
+    ) -> None:
+        """A class constructor
+
+        Args:
+            vectors (numpy array): Chunk embeddings, one row per chunk
+            n_tokens (array like): Number of tokens of each chunk
+            ann_index (IVFIndex, optional): Approximate index to search. Defaults to None.
+            nprobe (int, optional): Clusters searched in ann_index. Defaults to 8.
+            quantized (QuantizedVectors, optional): Quantized copy of vectors for the first pass. Defaults to None.
+            rescore (int, optional): Candidates per result rescored with vectors, 0 for none. Defaults to 4.
+            projection (PCAProjection, optional): Reduced copy of vectors for the first pass, used instead of quantized. Defaults to None.
+        """
+        if quantized is None and projection is None:
+            self.vectors = normalize_rows(vectors)
+        else:
+            # Stored vectors are unit length, do not read the whole memory-mapped matrix
+            self.vectors = vectors
+        self.ann_index = ann_index
+        self.nprobe = nprobe
+        self.quantized = quantized
+        self.projection = projection
+        # Compact copy of vectors scored before rescoring with vectors
+        self.first_pass = projection if projection is not None else quantized
+        self.rescore = rescore
+        self.n_tokens = np.asarray(n_tokens, dtype=np.int64)
+        self.min_chunk_len = (
+            int(self.n_tokens.min()) + SEPARATOR_TOKENS
+            if len(self.n_tokens)
+            else SEPARATOR_TOKENS
+        )
+
+    @classmethod
+    def for_index(cls, index):
+        """A method to get retriever of an index, building it once per index
+
+        Args:
+            index (EmbeddingIndex): Website index
+
+        Returns:
+            VectorRetriever: Retriever over the index vectors
+        """
+        retriever = index.retriever
+        if retriever is None:
+            with _build_lock:
+                retriever = index.retriever
+                if retriever is None:
+                    rescore = (
+                        constants.PROJECTION_RESCORE
+                        if index.projection is not None
+                        else constants.QUANTIZATION_RESCORE
+                    )
+                    # Page centroids narrow down chunks like IVF clusters
+                    if index.page_index is not None:
+                        ann_index = index.page_index
+                        nprobe = int(config.get(constants.PAGE_NPROBE))
+                    else:
+                        ann_index = index.ann_index
+                        nprobe = int(config.get(constants.ANN_NPROBE))
+                    retriever = cls(
+                        index.vectors,
+                        index.metadata["n_tokens"].values,
+                        ann_index=ann_index,
+                        nprobe=nprobe,
+                        quantized=index.quantized,
+                        rescore=int(config.get(rescore)),
+                        projection=index.projection,
+                    )
+                    index.retriever = retriever
+        return retriever
+
+    def scores(self, query_vector):
+        """A method to get cosine similarity of query with every chunk
+
+        Args:
+            query_vector (array like): Query embedding
+
+        Returns:
+            numpy array: Similarity of each chunk
+        """
+        return self.vectors @ normalize_query(query_vector)
+
+    def top_k(self, query_vector, k, exact=False):
+        """A method to get most similar chunks, best first
+
+        Args:
+            query_vector (array like): Query embedding
+            k (int): Number of chunks to return
+            exact (bool, optional): Score all chunks even if an approximate index exists. Defaults to False.
+
+        Returns:
+            numpy array: Row numbers of the k most similar chunks
+        """
+        query_vector = normalize_query(query_vector)
+        if exact or (self.ann_index is None and self.first_pass is None):
+            return top_rows(self.vectors @ query_vector, k)
+
+        rows = None
+        if self.ann_index is not None:
+            # Sorted rows keep reads of a memory-mapped matrix sequential
+            rows = np.sort(
+                self.ann_index.candidates(query_vector, self.nprobe)
+            )
+        if self.first_pass is None:
+            return rows[top_rows(self.vectors[rows] @ query_vector, k)]
+
+        # First pass over quantized or projected vectors in memory, then the
+        # best candidates are rescored with full precision vectors
+        scores = self.first_pass.scores(query_vector, rows)
+        n_candidates = k * self.rescore if self.rescore else k
+        candidates = top_rows(scores, n_candidates)
+        if rows is not None:
+            candidates = rows[candidates]
+        if not self.rescore:
+            return candidates
+        candidates = np.sort(candidates)
+        return candidates[top_rows(self.vectors[candidates] @ query_vector, k)]
+
+    def top_score(self, query_vector, rows=None):
+        """A method to get similarity of the chunk most similar to the query
+
+        Args:
+            query_vector (array like): Query embedding
+            rows (numpy array, optional): Chunks already retrieved for the query, best first. Defaults to None.
+
+        Returns:
+            float: Highest cosine similarity, 0 for an empty index
+        """
+        if rows is None:
+            rows = self.top_k(query_vector, 1)
+        if len(rows) == 0:
+            return 0.0
+        return float(self.vectors[rows[0]] @ normalize_query(query_vector))
+
+    def select_context(self, query_vector, max_len):
+        """A method to pick most similar chunks which fit in the context length
+
+        Args:
+            query_vector (array like): Query embedding
+            max_len (int): A maximum context length in tokens
+
+        Returns:
+            numpy array: Row numbers of selected chunks, best first
+        """
+        return self.pack(
+            self.top_k(query_vector, self.context_size(max_len)), max_len
+        )
+
+    def context_size(self, max_len):
+        """A method to get number of chunks worth retrieving for a context
+
+        Args:
+            max_len (int): A maximum context length in tokens
+
+        Returns:
+            int: No more chunks than this fit in max_len, even the shortest ones
+        """
+        return max_len // self.min_chunk_len + 1
+
+    def pack(self, rows, max_len):
+        """A method to keep the leading chunks whose total length fits max_len
+
+        Args:
+            rows (numpy array): Row numbers of chunks, best first
+            max_len (int): A maximum context length in tokens
+
+        Returns:
+            numpy array: Leading row numbers which fit in the context
+        """
+        lengths = np.cumsum(self.n_tokens[rows] + SEPARATOR_TOKENS)
+        return rows[: np.searchsorted(lengths, max_len, side="right")]
@@ -0,0 +1,149 @@
+"""A module to remove text repeated across pages of a website
+
+Navigation menus, cookie banners and footers appear on most pages of a website.
+Lines of page texts are hashed and counted once per page, and lines found on at
+least boilerplate_threshold of the pages are removed before chunking.
+"""
+
+import hashlib
+import json
+import os
+from collections import Counter
+from src.data_collection.chunker import get_tokenizer
+
+
+# Line counts of a website are saved next to its embeddings
+BOILERPLATE_FILE = "boilerplate.json"
+
+
+def line_hash(line):
+    """A method to get hash of a line of page text
+
+    Args:
+        line (str): A line of page text
+
+    Returns:
+        str: Hash of the line with collapsed whitespaces
+    """
+    return hashlib.blake2b(
+        " ".join(line.split()).encode("UTF-8"), digest_size=8
+    ).hexdigest()
+
+
+class BoilerplateFilter:
+    """A class to count lines across pages of a website and remove frequent ones"""
+
+    def __init__(self, threshold, min_pages) -> None:
+        """A class constructor
+
+        Args:
+            threshold (float): Minimum fraction of pages a line is on to be boilerplate
+            min_pages (int): Minimum pages counted before any line is removed
+        """
+        self.threshold = threshold
+        self.min_pages = min_pages
+        self.pages = 0
+        self.counts = Counter()
+        self.removed_tokens = 0
+
+    def observe(self, text):
+        """A method to count lines of a page
+
+        Args:
+            text (str): Page text with newlines
+        """
+        self.pages += 1
+        self.counts.update(
+            set(line_hash(line) for line in text.splitlines() if line.strip())
+        )
+
+    def is_boilerplate(self, line):
+        """A method to check if a line repeats across pages
+
+        Args:
+            line (str): A line of page text
+
+        Returns:
+            bool: True if line should be removed
+        """
+        if self.pages < self.min_pages:
+            return False
+        return self.counts[line_hash(line)] >= self.threshold * self.pages
+
+    def strip(self, text):
+        """A method to remove boilerplate lines of a page
+
+        Args:
+            text (str): Page text with newlines
+
+        Returns:
+            str: Page text without boilerplate lines
+        """
+        kept = []
+        removed = []
+        for line in text.splitlines():
+            if line.strip() and self.is_boilerplate(line):
+                removed.append(line)
+            else:
+                kept.append(line)
+        if removed:
+            self.removed_tokens += len(
+                get_tokenizer().encode_ordinary("\n".join(removed))
+            )
+        return "\n".join(kept)
+
+    def strip_pages(self, pages, sample_pages):
+        """A generator to remove boilerplate of crawled pages as they arrive
+
+        The first sample_pages pages are held back until their lines are
+        counted. Later pages are counted as they pass.
+
+        Args:
+            pages (iterable): Text file names and texts of crawled pages
+            sample_pages (int): Number of pages counted before the first page is passed on
+
+        Yields:
+            tuple: Text file name and text without boilerplate of every page
+        """
+        sample = []
+        for file_name, text in pages:
+            self.observe(text)
+            if self.pages < sample_pages:
+                sample.append((file_name, text))
+                continue
+            for sample_file_name, sample_text in sample:
+                yield sample_file_name, self.strip(sample_text)
+            sample = []
+            yield file_name, self.strip(text)
+        for sample_file_name, sample_text in sample:
+            yield sample_file_name, self.strip(sample_text)
+
+    def save(self, path):
+        """A method to save line counts, e.g. to strip pages of a later refresh
+
+        Args:
+            path (str): json file path
+        """
+        with open(path + ".tmp", "w", encoding="UTF-8") as f:
+            json.dump({"pages": self.pages, "counts": self.counts}, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path, threshold, min_pages):
+        """A method to load saved line counts
+
+        Args:
+            path (str): json file path
+            threshold (float): Minimum fraction of pages a line is on to be boilerplate
+            min_pages (int): Minimum pages counted before any line is removed
+
+        Returns:
+            BoilerplateFilter: Filter with saved counts, empty if file does not exist
+        """
+        boilerplate = cls(threshold, min_pages)
+        if os.path.exists(path):
+            with open(path, "r", encoding="UTF-8") as f:
+                saved = json.load(f)
+            boilerplate.pages = saved["pages"]
+            boilerplate.counts = Counter(saved["counts"])
+        return boilerplate
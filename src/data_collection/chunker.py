@@ -0,0 +1,152 @@
+"""A module to split website texts into chunks of a maximum number of tokens
+
+Every document is encoded once. Sentence boundaries are found on the tokens
+and chunks are decoded from token ranges, so number of tokens of a chunk is
+known without encoding it again. Documents are spread across processes.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import tiktoken
+
+
+# Documents below this count are chunked in the calling process
+MIN_DOCUMENTS_PER_PROCESS = 64
+
+_tokenizer = None
+_token_bytes = {}
+
+
+def get_tokenizer():
+    """A method to get tokenizer of current process
+
+    Returns:
+        tiktoken.Encoding: The cl100k_base tokenizer used by the ada-002 model
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return _tokenizer
+
+
+def token_bytes(token):
+    """A method to get bytes of a token, cached per process
+
+    Args:
+        token (int): A token id
+
+    Returns:
+        bytes: Bytes of the token
+    """
+    value = _token_bytes.get(token)
+    if value is None:
+        value = get_tokenizer().decode_single_token_bytes(token)
+        _token_bytes[token] = value
+    return value
+
+
+def sentence_ranges(tokens):
+    """A method to split tokens of a text into sentences ending with ". "
+
+    Args:
+        tokens (list): Tokens of a text
+
+    Returns:
+        list: (start, end) token positions of every sentence
+    """
+    ranges = []
+    start = 0
+    for position in range(len(tokens) - 1):
+        if token_bytes(tokens[position]).endswith(b".") and token_bytes(
+            tokens[position + 1]
+        ).startswith(b" "):
+            ranges.append((start, position + 1))
+            start = position + 1
+    ranges.append((start, len(tokens)))
+    return ranges
+
+
+def chunk_tokens(tokens, max_tokens):
+    """A method to group sentences of a tokenized text into chunks
+
+    Sentences are added to a chunk until it would exceed max_tokens. Sentences
+    longer than max_tokens are left out.
+
+    Args:
+        tokens (list): Tokens of a text
+        max_tokens (int): Maximum tokens of a chunk
+
+    Returns:
+        list: (chunk text, number of tokens) of every chunk
+    """
+    tokenizer = get_tokenizer()
+    if len(tokens) <= max_tokens:
+        return [(tokenizer.decode(tokens).strip(), len(tokens))]
+
+    chunks = []
+    chunk = []
+    for start, end in sentence_ranges(tokens):
+        # If the number of tokens so far plus the number of tokens in the current sentence is greater
+        # than the max number of tokens, then add the chunk to the list of chunks and reset the chunk
+        if chunk and len(chunk) + end - start > max_tokens:
+            chunks.append((tokenizer.decode(chunk).strip(), len(chunk)))
+            chunk = []
+
+        # If the number of tokens in the current sentence is greater than the max number of
+        # tokens, go to the next sentence
+        if end - start > max_tokens:
+            continue
+        chunk.extend(tokens[start:end])
+
+    if chunk:
+        chunks.append((tokenizer.decode(chunk).strip(), len(chunk)))
+    return chunks
+
+
+def chunk_batch(texts, max_tokens):
+    """A method to chunk a list of texts, encoding them with the batch encoder
+
+    Args:
+        texts (list): A list of texts
+        max_tokens (int): Maximum tokens of a chunk
+
+    Returns:
+        list: Total number of tokens and chunks of every text
+    """
+    return [
+        (len(tokens), chunk_tokens(tokens, max_tokens))
+        for tokens in get_tokenizer().encode_ordinary_batch(texts)
+    ]
+
+
+def chunk_documents(texts, max_tokens, workers=0, executor=None):
+    """A method to chunk many texts across a pool of processes
+
+    Args:
+        texts (list): A list of texts
+        max_tokens (int): Maximum tokens of a chunk
+        workers (int, optional): Number of processes, 0 for number of CPUs. Defaults to 0.
+        executor (ProcessPoolExecutor, optional): Pool to reuse across calls. Defaults to a new pool.
+
+    Returns:
+        list: Total number of tokens and chunks of every text, in order of texts
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(texts) // MIN_DOCUMENTS_PER_PROCESS)
+    if workers <= 1:
+        return chunk_batch(texts, max_tokens)
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return chunk_documents(texts, max_tokens, workers, executor)
+
+    batch_size = -(-len(texts) // workers)
+    batches = [
+        texts[start : start + batch_size]
+        for start in range(0, len(texts), batch_size)
+    ]
+    results = []
+    for result in executor.map(
+        chunk_batch, batches, [max_tokens] * len(batches)
+    ):
+        results.extend(result)
+    return results
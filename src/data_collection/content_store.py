@@ -0,0 +1,219 @@
+"""A module to reuse embeddings of identical text chunks across websites and rebuilds
+
+Embeddings are stored in a sqlite file keyed by a hash of the embedding model
+and normalized chunk text, so a chunk is embedded once however many websites
+or rebuilds contain it. Once the store is above its size cap, compaction
+removes least recently used entries down to a low-water mark below the cap, so
+it does not run again for every few added entries.
+
+Run this module as a script to compact the store:
+    python -m src.data_collection.content_store
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from src.utility.utils import config
+from src.utility import constants
+from src.utility.loggers import logger
+from src.data_collection.embedding_client import EMBEDDING_MODEL
+
+
+# Maximum keys in one sqlite query
+LOOKUP_BATCH_SIZE = 500
+# Share of max_entries kept by compaction
+LOW_WATER_MARK = 0.9
+# Share of free pages in the file above which compaction vacuums it
+VACUUM_FREE_SHARE = 0.5
+
+
+def content_key(text, model=EMBEDDING_MODEL):
+    """A method to get key of a chunk text
+
+    Args:
+        text (str): A chunk text
+        model (str, optional): Embedding model. Defaults to text-embedding-ada-002.
+
+    Returns:
+        str: sha256 of model and text with collapsed whitespaces
+    """
+    normalized = " ".join(text.split())
+    return hashlib.sha256(
+        (model + "\n" + normalized).encode("UTF-8")
+    ).hexdigest()
+
+
+class ContentEmbeddingStore:
+    """A class to store embeddings of chunk texts by content hash"""
+
+    def __init__(self, path, max_entries) -> None:
+        """A class constructor
+
+        Args:
+            path (str): sqlite file of the store
+            max_entries (int): Entries above which compaction removes least recently used ones
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings "
+            "(key TEXT PRIMARY KEY, last_used REAL, embedding BLOB)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS chunk_embeddings_last_used "
+            "ON chunk_embeddings (last_used)"
+        )
+        self._db.commit()
+
+    def get_many(self, texts, model=EMBEDDING_MODEL):
+        """A method to get stored embeddings of chunk texts
+
+        Args:
+            texts (list): Chunk texts
+            model (str, optional): Embedding model. Defaults to text-embedding-ada-002.
+
+        Returns:
+            list: Embeddings in the same order as texts, None for texts not stored
+        """
+        keys = [content_key(text, model) for text in texts]
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[start : start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                found.update(
+                    self._db.execute(
+                        "SELECT key, embedding FROM chunk_embeddings "
+                        "WHERE key IN (" + placeholders + ")",
+                        batch,
+                    ).fetchall()
+                )
+                self._db.execute(
+                    "UPDATE chunk_embeddings SET last_used = ? "
+                    "WHERE key IN (" + placeholders + ")",
+                    [now] + batch,
+                )
+            self._db.commit()
+            self.hits += sum(key in found for key in keys)
+            self.misses += sum(key not in found for key in keys)
+
+        return [
+            np.frombuffer(found[key], dtype=np.float32)
+            if key in found
+            else None
+            for key in keys
+        ]
+
+    def put_many(self, texts, embeddings, model=EMBEDDING_MODEL):
+        """A method to store embeddings of chunk texts
+
+        Args:
+            texts (list): Chunk texts
+            embeddings (list): Embeddings in the same order as texts
+            model (str, optional): Embedding model. Defaults to text-embedding-ada-002.
+        """
+        now = time.time()
+        rows = [
+            (
+                content_key(text, model),
+                now,
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+            )
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunk_embeddings VALUES (?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+
+    def __len__(self):
+        """Number of stored embeddings"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM chunk_embeddings"
+            ).fetchone()[0]
+
+    def compact(self, vacuum=False):
+        """A method to remove least recently used entries once there are more than max_entries
+
+        Entries are removed down to LOW_WATER_MARK of max_entries. Later
+        entries reuse the space of removed ones, so the sqlite file is only
+        vacuumed when most of it is free.
+
+        Args:
+            vacuum (bool, optional): Vacuum the file even if little of it is free. Defaults to False.
+
+        Returns:
+            int: Number of removed entries
+        """
+        count = len(self)
+        excess = 0
+        if count > self.max_entries:
+            excess = count - int(self.max_entries * LOW_WATER_MARK)
+        with self._lock:
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM chunk_embeddings WHERE key IN "
+                    "(SELECT key FROM chunk_embeddings "
+                    "ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._db.commit()
+            free_pages = self._db.execute("PRAGMA freelist_count").fetchone()[
+                0
+            ]
+            pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+            if vacuum or free_pages > VACUUM_FREE_SHARE * pages:
+                self._db.execute("VACUUM")
+        if excess > 0:
+            logger.info(
+                "Removed %d entries from chunk embedding store", excess
+            )
+        return excess
+
+    def stats(self):
+        """A method to get hit rate metrics of the store
+
+        Returns:
+            dict: Hits, misses and hit rate of chunk lookups
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Store shared by all websites, None if embedding_store_path is empty
+content_embedding_store = (
+    ContentEmbeddingStore(
+        config.get(constants.EMBEDDING_STORE_PATH),
+        int(config.get(constants.EMBEDDING_STORE_MAX_ENTRIES)),
+    )
+    if config.get(constants.EMBEDDING_STORE_PATH)
+    else None
+)
+
+
+if __name__ == "__main__":
+    if content_embedding_store is not None:
+        print(
+            "Removed "
+            + str(content_embedding_store.compact(vacuum=True))
+            + " entries, "
+            + str(len(content_embedding_store))
+            + " left"
+        )
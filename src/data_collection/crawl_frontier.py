@@ -0,0 +1,266 @@
+"""A module to decide which pages of a website are crawled and in which order
+
+robots.txt rules and crawl delay are respected, and pages listed in sitemaps
+are known before the first page is downloaded. Pages are crawled in order of
+sitemap priority and freshness, then of link depth, so a partial crawl of a
+large website gets its most important pages.
+"""
+
+import heapq
+import itertools
+import zlib
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+import defusedxml.ElementTree as ET
+
+
+USER_AGENT = "custom_chatgpt_chatbot"
+# Sitemap priority of pages without one and of pages found by links
+DEFAULT_PRIORITY = 0.5
+# Days after which freshness of a page modified on that day halves
+FRESHNESS_HALF_LIFE_DAYS = 30
+# Bytes read at a time from a response body
+READ_CHUNK_SIZE = 65536
+
+
+class CrawlFrontier:
+    """A class to hold links waiting to be crawled, best scored first"""
+
+    def __init__(self) -> None:
+        """A class constructor"""
+        self._heap = []
+        # Links of equal score are crawled in order they were found
+        self._counter = itertools.count()
+
+    def push(self, url, depth, score):
+        """A method to add a link
+
+        Args:
+            url (str): A page URL
+            depth (int): Links followed from start page to the page
+            score (float): Crawl priority, higher is crawled first
+        """
+        heapq.heappush(self._heap, (-score, next(self._counter), url, depth))
+
+    def pop(self):
+        """A method to remove the best scored link
+
+        Returns:
+            tuple: URL and depth of the link
+        """
+        _, _, url, depth = heapq.heappop(self._heap)
+        return url, depth
+
+    def clear(self):
+        """A method to remove all links"""
+        self._heap = []
+
+    def __len__(self):
+        """Number of links waiting"""
+        return len(self._heap)
+
+
+def link_score(depth):
+    """A method to get crawl priority of a page found by following links
+
+    Args:
+        depth (int): Links followed from start page to the page
+
+    Returns:
+        float: Crawl priority
+    """
+    return DEFAULT_PRIORITY / max(depth, 1)
+
+
+def sitemap_score(priority=None, lastmod=None, now=None):
+    """A method to get crawl priority of a page listed in a sitemap
+
+    Args:
+        priority (str, optional): Sitemap priority between 0 and 1. Defaults to None.
+        lastmod (str, optional): W3C datetime of last modification. Defaults to None.
+        now (datetime, optional): Current time. Defaults to None.
+
+    Returns:
+        float: Sitemap priority plus freshness between 0 and 1
+    """
+    try:
+        score = min(max(float(priority), 0.0), 1.0)
+    except (TypeError, ValueError):
+        score = DEFAULT_PRIORITY
+
+    if lastmod:
+        try:
+            modified = datetime.fromisoformat(
+                lastmod.strip().replace("Z", "+00:00")
+            )
+        except ValueError:
+            return score
+        if modified.tzinfo is None:
+            modified = modified.replace(tzinfo=timezone.utc)
+        now = now or datetime.now(timezone.utc)
+        age_days = max((now - modified).total_seconds() / 86400, 0.0)
+        score += 0.5 ** (age_days / FRESHNESS_HALF_LIFE_DAYS)
+    return score
+
+
+def read_body(response, max_bytes):
+    """A method to read a streamed response body up to a size limit
+
+    Args:
+        response (requests.Response): A response requested with stream=True
+        max_bytes (int): Maximum body size, 0 for no limit
+
+    Returns:
+        bytes: Response body, None if it is larger than max_bytes
+    """
+    content_length = response.headers.get("Content-Length")
+    if max_bytes and content_length and content_length.isdigit():
+        if int(content_length) > max_bytes:
+            return None
+
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+        body.extend(chunk)
+        if max_bytes and len(body) > max_bytes:
+            return None
+    return bytes(body)
+
+
+def load_robots(root_url, session, timeout):
+    """A method to download and parse robots.txt of a website
+
+    Args:
+        root_url (str): Scheme and host of the website
+        session (requests.Session): HTTP session
+        timeout (float): Request timeout in seconds
+
+    Returns:
+        RobotFileParser: Rules of the website, allowing everything if robots.txt is missing
+    """
+    robots = RobotFileParser(root_url + "/robots.txt")
+    try:
+        response = session.get(root_url + "/robots.txt", timeout=timeout)
+    except Exception as e:
+        print(e)
+        robots.parse([])
+        return robots
+
+    if response.status_code in (401, 403):
+        robots.disallow_all = True
+    elif response.status_code >= 400:
+        robots.allow_all = True
+    else:
+        robots.parse(response.text.splitlines())
+    return robots
+
+
+def local_name(tag):
+    """A method to get XML tag name without namespace
+
+    Args:
+        tag (str): Tag name, e.g. {http://www.sitemaps.org/schemas/sitemap/0.9}url
+
+    Returns:
+        str: Tag name without namespace
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_sitemap(content, max_bytes=0):
+    """A method to parse a sitemap or sitemap index
+
+    Entities and DTDs are not resolved, sitemaps come from untrusted websites.
+
+    Args:
+        content (bytes): Sitemap XML, optionally gzip compressed
+        max_bytes (int, optional): Maximum decompressed size, 0 for no limit. Defaults to 0.
+
+    Returns:
+        tuple: URLs of child sitemaps and (loc, lastmod, priority) of pages
+
+    Raises:
+        ValueError: If decompressed sitemap is larger than max_bytes
+    """
+    if content[:2] == b"\x1f\x8b":
+        # Decompress no more than max_bytes, a small file may expand a lot
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        content = decompressor.decompress(
+            content, max_bytes + 1 if max_bytes else 0
+        )
+        if max_bytes and len(content) > max_bytes:
+            raise ValueError(
+                "decompressed sitemap is larger than "
+                + str(max_bytes)
+                + " bytes"
+            )
+    root = ET.fromstring(content)
+
+    sitemaps = []
+    pages = []
+    for element in root:
+        fields = {
+            local_name(child.tag): (child.text or "").strip()
+            for child in element
+        }
+        if not fields.get("loc"):
+            continue
+        if local_name(element.tag) == "sitemap":
+            sitemaps.append(fields["loc"])
+        elif local_name(element.tag) == "url":
+            pages.append(
+                (fields["loc"], fields.get("lastmod"), fields.get("priority"))
+            )
+    return sitemaps, pages
+
+
+def iter_sitemap_pages(
+    sitemap_urls, session, timeout, max_sitemaps, wait=None, max_bytes=0
+):
+    """A generator to get pages of sitemaps, following sitemap indexes
+
+    Args:
+        sitemap_urls (list): URLs of sitemaps to start from
+        session (requests.Session): HTTP session
+        timeout (float): Request timeout in seconds
+        max_sitemaps (int): Maximum sitemap files downloaded
+        wait (callable, optional): Called with host before every request, e.g. to rate limit. Defaults to None.
+        max_bytes (int, optional): Maximum size of a sitemap, downloaded and decompressed, 0 for no limit. Defaults to 0.
+
+    Yields:
+        tuple: loc, lastmod and priority of every page
+    """
+    queue = list(sitemap_urls)
+    seen = set(queue)
+    downloaded = 0
+    while queue and downloaded < max_sitemaps:
+        sitemap_url = queue.pop(0)
+        downloaded += 1
+        if wait is not None:
+            wait(urlparse(sitemap_url).netloc)
+        try:
+            with session.get(
+                sitemap_url, timeout=timeout, stream=True
+            ) as response:
+                if response.status_code >= 400:
+                    continue
+                content = read_body(response, max_bytes)
+            if content is None:
+                print(
+                    "Skipping sitemap "
+                    + sitemap_url
+                    + " larger than "
+                    + str(max_bytes)
+                    + " bytes"
+                )
+                continue
+            sitemaps, pages = parse_sitemap(content, max_bytes)
+        except Exception as e:
+            print("Unable to read sitemap " + sitemap_url + ": " + str(e))
+            continue
+
+        for child in sitemaps:
+            if child not in seen:
+                seen.add(child)
+                queue.append(child)
+        yield from pages
@@ -2,19 +2,38 @@
 """
 
 import os
+import sys
+import numpy as np
 import pandas as pd
 from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
 import tiktoken
 import openai
-from openai.embeddings_utils import distances_from_embeddings
-import numpy as np
 from src.utility.utils import config
 from src.utility import constants
+from src.utility.loggers import logger
 from src.utility.nlp_text_cleaner import remove_newlines
 from src.data_collection import web_crawler
+from src.data_collection.embedding_store import EmbeddingStore
+from src.data_collection.embedding_client import embed_stream, embed_texts
+from src.data_collection.content_store import content_embedding_store
+from src.data_collection.chunker import chunk_batch, chunk_documents
+from src.data_collection.ingestion_jobs import CRAWLING, EMBEDDING, IngestionJob
+from src.data_collection.pipeline import threaded
+from src.data_collection.boilerplate import BOILERPLATE_FILE, BoilerplateFilter
+from src.data_collection.near_duplicates import NearDuplicateIndex
+from src.chatbot_core.ivf_index import IVFIndex
+from src.chatbot_core.quantization import QuantizedVectors
+from src.chatbot_core.projection import PCAProjection
+from src.chatbot_core.bm25_index import BM25Index
+from src.chatbot_core.retriever import RETRIEVAL_VECTOR
 
 
 openai.api_key = config.get(constants.OPENAI_API_KEY)
+# Chunk texts decompressed at a time while building BM25 index
+TEXT_BATCH_SIZE = 4096
+# Crawled pages chunked together, enough to spread across a few processes
+CHUNK_BATCH_PAGES = 256
 
 class DataProcessor:
     """A class having data processing methods
@@ -32,17 +51,64 @@ class DataProcessor:
         #self.domain = config.get(constants.DOMAIN)
         self.full_url = full_url
         self.local_domain = urlparse(self.full_url).netloc
+        self.store = EmbeddingStore(self.local_domain)
         
 
-    def create_dataset_from_text_files(self):
+    def boilerplate_filter(self, saved=False):
+        """A method to get filter of text repeated across pages of the website
+
+        Args:
+            saved (bool, optional): Load line counts saved by the last full crawl. Defaults to False.
+
+        Returns:
+            BoilerplateFilter: A filter configured by boilerplate_threshold and boilerplate_min_pages
+        """
+        threshold = float(config.get(constants.BOILERPLATE_THRESHOLD))
+        min_pages = int(config.get(constants.BOILERPLATE_MIN_PAGES))
+        if saved:
+            return BoilerplateFilter.load(
+                self.store.path(BOILERPLATE_FILE), threshold, min_pages
+            )
+        return BoilerplateFilter(threshold, min_pages)
+
+
+    def near_duplicate_index(self):
+        """A method to get an index detecting near-duplicate chunks
+
+        Returns:
+            NearDuplicateIndex: An index with near_duplicate_threshold, None if threshold is 0
+        """
+        threshold = float(config.get(constants.NEAR_DUPLICATE_THRESHOLD))
+        if not threshold:
+            return None
+        return NearDuplicateIndex(
+            threshold, num_perm=int(config.get(constants.NEAR_DUPLICATE_NUM_PERM))
+        )
+
+
+    def create_dataset_from_text_files(self, file_names=None):
         """A method to create data file from website text files.
+
+        Lines repeated across pages(menus, footers) are removed. When all files
+        are read their lines are counted, otherwise counts of the last full
+        crawl are used.
+
+        Args:
+            file_names (list, optional): Text file names without extension to read. Defaults to all files.
+
+        Returns:
+            df (pandas): A dataframe with page name, text and text file name
         """
 
         # Create a list to store the text files
         texts = []
 
         # Get all the text files in the text directory
-        for file in os.listdir(config.get(constants.TEXT_DATA_PATH) + self.local_domain + "/"):
+        if file_names is None:
+            files = os.listdir(config.get(constants.TEXT_DATA_PATH) + self.local_domain + "/")
+        else:
+            files = [file_name + ".txt" for file_name in file_names]
+        for file in files:
             # Open the file and read the text
             with open(
                 config.get(constants.TEXT_DATA_PATH) + self.local_domain + "/" + file,
@@ -59,28 +125,79 @@ class DataProcessor:
                         .replace("_", " ")
                         .replace("#update", ""),
                         text,
+                        file[:-4],
                     )
                 )
 
+        # Remove boilerplate lines before newlines are removed
+        boilerplate = self.boilerplate_filter(saved=file_names is not None)
+        if file_names is None:
+            for _, text, _ in texts:
+                boilerplate.observe(text)
+            boilerplate.save(self.store.path(BOILERPLATE_FILE))
+        texts = [
+            (fname, boilerplate.strip(text), file) for fname, text, file in texts
+        ]
+        logger.info(
+            "Removed %d boilerplate tokens from %d pages of %s",
+            boilerplate.removed_tokens,
+            len(texts),
+            self.local_domain,
+        )
+
         # Create a dataframe from the list of texts
-        df = pd.DataFrame(texts, columns=["fname", "text"])
+        df = pd.DataFrame(texts, columns=["fname", "text", "file"])
 
         # Set the text column to be the raw text with the newlines removed
         df["text"] = df.fname + ". " + remove_newlines(df.text)
         df.to_csv(config.get(constants.EMBEDDINGS_DATA_PATH) + self.local_domain + "/scraped.csv")
+        return df
  
 
-    def tokenize_texts(self):
+    def clean_page(self, file_name, text):
+        """A method to get text of a crawled page as create_dataset_from_text_files does
+
+        Args:
+            file_name (str): Text file name of the page without extension
+            text (str): Page text
+
+        Returns:
+            str: Page title followed by page text without newlines
+        """
+        title = (
+            file_name[11:]
+            .replace("-", " ")
+            .replace("_", " ")
+            .replace("#update", "")
+        )
+        return title + ". " + remove_newlines(pd.Series([text]))[0]
+
+
+    def tokenize_texts(self, df=None):
         """A mthod to tokenize text data
 
+        Every text is encoded once and split into chunks on the same pass, see
+        src.data_collection.chunker. Texts are spread across chunking_workers processes.
+
+        Args:
+            df (pandas, optional): Dataframe from create_dataset_from_text_files. Defaults to reading scraped.csv.
+
         Returns:
-            dataframe (pandas): A dataframe with tokenized text
+            dataframe (pandas): A dataframe with number of tokens and chunks of every text
         """        
-        df = pd.read_csv(config.get(constants.EMBEDDINGS_DATA_PATH) + self.local_domain + "/scraped.csv", index_col=0)
-        df.columns = ["title", "text"]
-
-        # Tokenize the text and save the number of tokens to a new column
-        df["n_tokens"] = df.text.apply(lambda x: len(self.tokenizer.encode(x)))
+        if df is None:
+            df = pd.read_csv(config.get(constants.EMBEDDINGS_DATA_PATH) + self.local_domain + "/scraped.csv", index_col=0)
+        df.columns = ["title", "text", "file"]
+        df = df[df.text.notna()].reset_index(drop=True)
+
+        # Tokenize the text and save the number of tokens and (chunk, n_tokens) pairs to new columns
+        results = chunk_documents(
+            df.text.tolist(),
+            self.max_tokens,
+            workers=int(config.get(constants.CHUNKING_WORKERS)),
+        )
+        df["n_tokens"] = [n_tokens for n_tokens, _ in results]
+        df["chunks"] = [chunks for _, chunks in results]
 
         # Visualize the distribution of the number of tokens per row using a histogram
         # df.n_tokens.hist()
@@ -97,112 +214,402 @@ class DataProcessor:
         Returns:
             chunks (list): A list of chunks of split text data
         """        
-        # Split the text into sentences
-        sentences = text.split(". ")
-
-        # Get the number of tokens for each sentence
-        n_tokens = [len(self.tokenizer.encode(" " + sentence)) for sentence in sentences]
-
-        chunks = []
-        tokens_so_far = 0
-        chunk = []
-
-        # Loop through the sentences and tokens joined together in a tuple
-        for sentence, token in zip(sentences, n_tokens):
-            # If the number of tokens so far plus the number of tokens in the current sentence is greater
-            # than the max number of tokens, then add the chunk to the list of chunks and reset
-            # the chunk and tokens so far
-            if tokens_so_far + token > self.max_tokens:
-                chunks.append(". ".join(chunk) + ".")
-                chunk = []
-                tokens_so_far = 0
-
-            # If the number of tokens in the current sentence is greater than the max number of
-            # tokens, go to the next sentence
-            if token > self.max_tokens:
-                continue
-
-            # Otherwise, add the sentence to the chunk and add the number of tokens to the total
-            chunk.append(sentence)
-            tokens_so_far += token + 1
-
-        return chunks
+        return [chunk for chunk, _ in chunk_batch([text], self.max_tokens)[0][1]]
 
 
     def create_initial_dataset(self,df):
         """A method to create initial dataframe from text
 
+        Only the first of near-duplicate chunks(e.g. same page under another URL) is kept.
+
         Args:
-            df (pandas): A dataframe with text data
+            df (pandas): A dataframe from tokenize_texts
 
         Returns:
             df (pandas): A dataframe with tokenized and chunk text data
         """        
-        shortened = []
-
-        # Loop through the dataframe
-        for row in df.iterrows():
-            # If the text is None, go to the next row
-            if row[1]["text"] is None:
-                continue
-
-            # If the number of tokens is greater than the max number of tokens, split the text into chunks
-            if row[1]["n_tokens"] > self.max_tokens:
-                shortened += self.split_into_many(row[1]["text"])
-
-            # Otherwise, add the text to the list of shortened texts
-            else:
-                shortened.append(row[1]["text"])
+        # Number of tokens of every chunk is kept from tokenize_texts
+        shortened = [
+            (chunk, file, n_tokens)
+            for chunks, file in zip(df["chunks"], df["file"])
+            for chunk, n_tokens in chunks
+        ]
+
+        near_duplicates = self.near_duplicate_index()
+        if near_duplicates is not None:
+            shortened = [
+                row for row in shortened if not near_duplicates.add(row[0])
+            ]
+            logger.info(
+                "Removed %d near-duplicate chunks of %s",
+                near_duplicates.duplicates,
+                self.local_domain,
+            )
 
         ################################################################################
         ### Step 9
         ################################################################################
 
-        df = pd.DataFrame(shortened, columns=["text"])
-        df["n_tokens"] = df.text.apply(lambda x: len(self.tokenizer.encode(x)))
+        df = pd.DataFrame(shortened, columns=["text", "file", "n_tokens"])
         # df.n_tokens.hist()
         return df
 
 
-    def create_embeddings(self,df):
+    def embed_chunks(self, df, progress=None):
+        """A method to add embeddings of text chunks to a dataframe
+
+        Args:
+            df (pandas dataframe): A dataframe with tokenized and chunk text data
+            progress (callable, optional): Called with number of chunks embedded by each batch. Defaults to None.
+
+        Returns:
+            df (pandas dataframe): Chunks with embeddings, without chunks whose embedding failed
+        """
+        # Chunks are sent in batches bounded by embedding_batch_tokens and embedding_batch_size,
+        # several batches at a time. Rate limited batches are retried with backoff, see
+        # https://platform.openai.com/docs/guides/rate-limits
+
+        # Chunks already embedded for any website are taken from the content store
+        df["embeddings"] = embed_texts(
+            df.text.tolist(),
+            df.n_tokens.tolist(),
+            progress=progress,
+            cache=content_embedding_store,
+        )
+
+        failed = df["embeddings"].isna()
+        if failed.any():
+            logger.error(
+                "Skipping %d chunks of %s without embeddings",
+                failed.sum(),
+                self.local_domain,
+            )
+            df = df[~failed]
+        if content_embedding_store is not None:
+            content_embedding_store.compact()
+        return df
+
+
+    def create_embeddings(self,df, progress=None):
         """A method to create text embeddings of text chunks
 
         Args:
             df (pandas dataframe): A dataframe with tokenized and chunk text data
+            progress (callable, optional): Called with number of chunks embedded by each batch. Defaults to None.
         """        
-        # Note that you may run into rate limit issues depending on how many files you try to embed
-        # Please check out our rate limit guide to learn more on how to handle
-        # this: https://platform.openai.com/docs/guides/rate-limits
+        self.store.save_dataframe(self.embed_chunks(df, progress=progress))
+        # df.head()
 
-        df["embeddings"] = df.text.apply(
-            lambda x: openai.Embedding.create(input=x, engine="text-embedding-ada-002")[
-                "data"
-            ][0]["embedding"]
+
+    def chunk_pages(self, pages, job, keep_files=False):
+        """A generator to clean and chunk crawled pages in batches
+
+        Boilerplate is removed after the first boilerplate_sample_pages pages
+        are counted, see BoilerplateFilter.strip_pages. Every CHUNK_BATCH_PAGES
+        pages are chunked together across chunking_workers processes. Chunks
+        nearly identical to an earlier chunk are dropped.
+
+        Args:
+            pages (iterable): Text file names and texts of crawled pages
+            job (IngestionJob): Job to report number of chunks to
+            keep_files (bool, optional): Save page texts to text files for debugging. Defaults to False.
+
+        Yields:
+            tuple: (text, file, n_tokens) of every chunk
+        """
+        def raw_pages():
+            for file_name, text in pages:
+                if keep_files:
+                    web_crawler.save_page_text(
+                        self.local_domain, file_name, text
+                    )
+                yield file_name, text
+
+        def page_batches():
+            batch = []
+            for file_name, text in boilerplate.strip_pages(
+                raw_pages(),
+                int(config.get(constants.BOILERPLATE_SAMPLE_PAGES)),
+            ):
+                batch.append((file_name, self.clean_page(file_name, text)))
+                if len(batch) == CHUNK_BATCH_PAGES:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        boilerplate = self.boilerplate_filter()
+        near_duplicates = self.near_duplicate_index()
+        workers = int(config.get(constants.CHUNKING_WORKERS))
+        # Processes are only started once a batch is large enough
+        with ProcessPoolExecutor(max_workers=workers or None) as executor:
+            for batch in page_batches():
+                job.tokens_removed = boilerplate.removed_tokens
+                results = chunk_documents(
+                    [text for _, text in batch],
+                    self.max_tokens,
+                    workers=workers,
+                    executor=executor,
+                )
+                for (file_name, _), (_, chunks) in zip(batch, results):
+                    if near_duplicates is not None:
+                        chunks = [
+                            (chunk, n_tokens)
+                            for chunk, n_tokens in chunks
+                            if not near_duplicates.add(chunk)
+                        ]
+                        job.duplicate_chunks = near_duplicates.duplicates
+                    job.add_chunks_total(len(chunks))
+                    for chunk, n_tokens in chunks:
+                        yield chunk, file_name, n_tokens
+
+        job.tokens_removed = boilerplate.removed_tokens
+        boilerplate.save(self.store.path(BOILERPLATE_FILE))
+        logger.info(
+            "Removed %d boilerplate tokens from %d pages of %s",
+            boilerplate.removed_tokens,
+            boilerplate.pages,
+            self.local_domain,
         )
-        df.to_csv(config.get(constants.EMBEDDINGS_DATA_PATH) + self.local_domain + "/embeddings.csv")
-        # df.head()
+        if near_duplicates is not None:
+            logger.info(
+                "Removed %d near-duplicate chunks of %s",
+                near_duplicates.duplicates,
+                self.local_domain,
+            )
+        # Website is crawled, remaining chunks are being embedded
+        job.set_status(EMBEDDING)
+
+
+    def stream_embeddings(self, job):
+        """A method to crawl, chunk, embed and save a website in one streaming pass
+
+        Stages run concurrently with at most pipeline_queue_size items between
+        them, so memory use does not grow with the website. Page texts and
+        scraped.csv are only written with keep_intermediate_files.
+
+        Args:
+            job (IngestionJob): Job to report crawling and embedding progress to
+        """
+        queue_size = int(config.get(constants.PIPELINE_QUEUE_SIZE))
+        keep_files = config.get(constants.KEEP_INTERMEDIATE_FILES) == "true"
 
+        job.set_status(CRAWLING)
+        pages = threaded(
+            web_crawler.iter_pages(self.full_url, on_page=job.add_page),
+            queue_size,
+        )
+        chunks = threaded(self.chunk_pages(pages, job, keep_files), queue_size)
+        with self.store.writer() as writer:
+            for batch, embeddings in embed_stream(
+                chunks, progress=job.add_chunks, cache=content_embedding_store
+            ):
+                writer.append(
+                    pd.DataFrame(batch, columns=["text", "file", "n_tokens"]),
+                    embeddings,
+                )
+
+        if content_embedding_store is not None:
+            content_embedding_store.compact()
+        if keep_files:
+            self.create_dataset_from_text_files()
 
-    def get_embeddings(self):
-        """A method to retun embeddings dataframe
+
+    def get_embeddings(self, job=None):
+        """A method to retun embeddings index, creating it on first use
+
+        Args:
+            job (IngestionJob, optional): Job to report crawling and embedding progress to. Defaults to None.
 
         Returns:
-            df (pandas dataframe): A dataframe with text embeddings
+            index (EmbeddingIndex): Chunk metadata with memory-mapped embeddings
         """
-        if not os.path.exists(
-            config.get(constants.EMBEDDINGS_DATA_PATH)
-            + self.local_domain
-            + "/"
+        if not self.store.exists():
+            job = job or IngestionJob(self.local_domain, self.full_url)
+            if self.store.has_legacy_csv():
+                self.store.migrate_csv()
+            else:
+                self.stream_embeddings(job)
+            self.build_search_indexes()
+
+        index = self.store.load()
+        if index.texts is None:
+            # Index saved before chunk texts were compressed
+            self.store.compress_texts()
+            index = self.store.load()
+        if int(config.get(constants.VECTOR_PROJECTION_DIMENSIONS)):
+            missing = index.projection is None
+        else:
+            quantization = config.get(constants.VECTOR_QUANTIZATION)
+            # Also replaces copies of another type, e.g. float16 of older versions
+            missing = quantization != "none" and (
+                index.quantized is None
+                or index.quantized.dtype != quantization
+            )
+        if missing:
+            # Index saved before, or with other settings than, current compact vectors
+            self.build_compact_vectors()
+            index = self.store.load()
+        if index.page_index is None and self.has_many_pages(index):
+            # Index saved before chunks were searched page by page
+            self.build_ann_index()
+            index = self.store.load()
+        if (
+            index.lexical_index is None
+            and config.get(constants.RETRIEVAL_MODE) != RETRIEVAL_VECTOR
         ):
+            self.build_lexical_index()
+            index = self.store.load()
+        return index
+
+    def build_search_indexes(self):
+        """A method to build approximate index, compact vectors and BM25 index of stored chunks
+        """
+        self.build_ann_index()
+        self.build_compact_vectors()
+        if config.get(constants.RETRIEVAL_MODE) != RETRIEVAL_VECTOR:
+            self.build_lexical_index()
+
+    def build_lexical_index(self):
+        """A method to build BM25 inverted index of stored chunk texts
+        """
+        index = self.store.load()
+        text_batches = (
+            index.chunk_texts(
+                range(start, min(start + TEXT_BATCH_SIZE, len(index)))
+            )
+            for start in range(0, len(index), TEXT_BATCH_SIZE)
+        )
+        self.store.save_lexical_index(
+            BM25Index.build(text_batches), index.version
+        )
+
+    def build_compact_vectors(self):
+        """A method to save projected vectors if vector_projection_dimensions is set, else quantized vectors
+        """
+        if int(config.get(constants.VECTOR_PROJECTION_DIMENSIONS)):
+            self.build_projection()
+        else:
+            self.build_quantized_vectors()
+
+    def build_projection(self):
+        """A method to fit a PCA projection to stored embeddings and save reduced vectors
+        """
+        index = self.store.load()
+        self.store.save_projection(
+            PCAProjection.fit(
+                index.vectors,
+                int(config.get(constants.VECTOR_PROJECTION_DIMENSIONS)),
+            ),
+            index.version,
+        )
+
+    def build_quantized_vectors(self):
+        """A method to save an int8 copy of stored embeddings, as set by vector_quantization
+        """
+        quantization = config.get(constants.VECTOR_QUANTIZATION)
+        if quantization == "none":
+            return
+        index = self.store.load()
+        self.store.save_quantized(
+            QuantizedVectors.quantize(index.vectors, quantization),
+            index.version,
+        )
+
+    def has_many_pages(self, index):
+        """A method to check if chunks of a website are searched page by page
+
+        Args:
+            index (EmbeddingIndex): Website index
+
+        Returns:
+            bool: True if index has at least page_index_min_pages pages and ann_min_chunks chunks
+        """
+        min_pages = int(config.get(constants.PAGE_INDEX_MIN_PAGES))
+        # Smaller websites are searched exactly, as without a page index
+        return (
+            min_pages > 0
+            and len(index) >= int(config.get(constants.ANN_MIN_CHUNKS))
+            and "file" in index.metadata.columns
+            and index.metadata["file"].nunique() >= min_pages
+        )
+
+    def build_ann_index(self):
+        """A method to build page index of websites with many pages, else approximate nearest neighbour index of large websites
+        """
+        index = self.store.load()
+        if self.has_many_pages(index):
+            self.store.save_page_index(
+                IVFIndex.from_groups(index.vectors, index.metadata["file"]),
+                index.version,
+            )
+            return
+        if len(index) < int(config.get(constants.ANN_MIN_CHUNKS)):
+            return
+        nlist = int(config.get(constants.ANN_NLIST)) or None
+        self.store.save_ann_index(
+            IVFIndex.build(index.vectors, nlist=nlist), index.version
+        )
+
+    def refresh_embeddings(self):
+        """A method to update embeddings with pages changed since the last crawl
+
+        Pages are requested with their previous ETag/Last-Modified, and only
+        new or modified pages are chunked and embedded again. Chunks of changed
+        and removed pages are replaced in the stored index.
+
+        Returns:
+            index (EmbeddingIndex): Updated index
+        """
+        if not self.store.exists():
+            return self.get_embeddings()
+
+        index = self.store.load()
+        if "file" not in index.metadata.columns:
+            # Index created before chunks kept their page, rebuild it fully
             web_crawler.crawl(self.full_url)
+            dataset = self.tokenize_texts(self.create_dataset_from_text_files())
+            self.create_embeddings(self.create_initial_dataset(dataset))
+            self.build_search_indexes()
+            return self.store.load()
+
+        result = web_crawler.crawl(self.full_url, incremental=True)
+        logger.info(
+            "Refresh of %s: %d changed pages, %d removed pages",
+            self.local_domain,
+            len(result.changed),
+            len(result.removed),
+        )
+        if not result.changed and not result.removed:
+            return index
+
+        new_chunks = pd.DataFrame(columns=["text", "file", "n_tokens"])
+        if result.changed:
+            dataset = self.tokenize_texts(
+                self.create_dataset_from_text_files(result.changed)
+            )
+            new_chunks = self.embed_chunks(self.create_initial_dataset(dataset))
+
+        keep = ~index.metadata["file"].isin(result.changed + result.removed)
+        vectors = np.asarray(index.vectors)[keep.values]
+        kept_chunks = index.metadata[keep].assign(
+            text=index.chunk_texts(np.flatnonzero(keep.values))
+        )
+        if len(new_chunks):
+            vectors = np.vstack(
+                [vectors, np.array(new_chunks["embeddings"].tolist())]
+            )
+            new_chunks = new_chunks.drop(columns=["embeddings"])
+        metadata = pd.concat(
+            [kept_chunks, new_chunks], ignore_index=True
+        )
+        self.store.save(metadata, vectors)
+        self.build_search_indexes()
+        return self.store.load()
 
-            self.create_dataset_from_text_files()
-            dataset = self.tokenize_texts()
-            dataset = self.create_initial_dataset(dataset)
-            self.create_embeddings(dataset)
 
-        df = pd.read_csv(config.get(constants.EMBEDDINGS_DATA_PATH) + self.local_domain + "/embeddings.csv", index_col=0)
-        df["embeddings"] = df["embeddings"].apply(eval).apply(np.array)
-        
-        return df
- 
\ No newline at end of file
+if __name__ == "__main__":
+    # Refresh embeddings of given websites, e.g. from a nightly job:
+    # python -m src.data_collection.data_processor https://www.example.com
+    for website_url in sys.argv[1:]:
+        DataProcessor(website_url).refresh_embeddings()
@@ -0,0 +1,253 @@
+"""A module to create text embeddings with batched, concurrent openai requests
+"""
+
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+import openai
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from src.utility.utils import config
+from src.utility import constants
+from src.utility.loggers import logger
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Errors which may pass on retrying, e.g. not an invalid key or too long input
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.ServiceUnavailableError,
+)
+
+
+def create_batches(n_tokens, max_batch_tokens, max_batch_items):
+    """A method to group consecutive texts into batches within token and item limits
+
+    A text longer than max_batch_tokens gets a batch of its own.
+
+    Args:
+        n_tokens (list): Number of tokens of every text
+        max_batch_tokens (int): Maximum total tokens of a batch
+        max_batch_items (int): Maximum number of texts in a batch
+
+    Returns:
+        list: A list of batches, each a list of text positions
+    """
+    batches = []
+    batch = []
+    tokens_so_far = 0
+    for position, tokens in enumerate(n_tokens):
+        if batch and (
+            tokens_so_far + tokens > max_batch_tokens
+            or len(batch) >= max_batch_items
+        ):
+            batches.append(batch)
+            batch = []
+            tokens_so_far = 0
+        batch.append(position)
+        tokens_so_far += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+@retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+def embed_batch(texts):
+    """A method to get embeddings of a list of texts in one request
+
+    Requests failing with a RETRYABLE_ERRORS error are retried with
+    exponential backoff, other errors are raised right away.
+
+    Args:
+        texts (list): A list of texts
+
+    Returns:
+        list: Embeddings in the same order as texts
+    """
+    response = openai.Embedding.create(input=texts, engine=EMBEDDING_MODEL)
+    data = sorted(response["data"], key=lambda item: item["index"])
+    return [item["embedding"] for item in data]
+
+
+def embed_texts(texts, n_tokens, progress=None, cache=None):
+    """A method to get embeddings of many texts with concurrent batched requests
+
+    Args:
+        texts (list): A list of texts
+        n_tokens (list): Number of tokens of every text
+        progress (callable, optional): Called with number of texts embedded by each finished batch. Defaults to None.
+        cache (ContentEmbeddingStore, optional): Store to look texts up in before embedding them and to save new embeddings to. Defaults to None.
+
+    Returns:
+        list: Embeddings in the same order as texts, None for texts whose batch failed
+    """
+    if cache is not None:
+        embeddings = cache.get_many(texts)
+    else:
+        embeddings = [None] * len(texts)
+    missing = [
+        position
+        for position, embedding in enumerate(embeddings)
+        if embedding is None
+    ]
+    if progress is not None and len(missing) < len(texts):
+        progress(len(texts) - len(missing))
+
+    batches = [
+        [missing[i] for i in batch]
+        for batch in create_batches(
+            [n_tokens[position] for position in missing],
+            int(config.get(constants.EMBEDDING_BATCH_TOKENS)),
+            int(config.get(constants.EMBEDDING_BATCH_SIZE)),
+        )
+    ]
+
+    with ThreadPoolExecutor(
+        max_workers=int(config.get(constants.EMBEDDING_WORKERS))
+    ) as executor:
+        futures = {
+            executor.submit(
+                embed_batch, [texts[position] for position in batch]
+            ): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                for position, embedding in zip(batch, future.result()):
+                    embeddings[position] = embedding
+            except Exception as e:
+                logger.error(
+                    "Embedding batch of %d texts failed: %s", len(batch), e
+                )
+                continue
+            if cache is not None:
+                cache.put_many(
+                    [texts[position] for position in batch],
+                    [embeddings[position] for position in batch],
+                )
+            if progress is not None:
+                progress(len(batch))
+
+    return embeddings
+
+
+def lookup_cached(chunks, cache, group_size):
+    """A generator to pair chunks with their stored embeddings, looked up in groups
+
+    Args:
+        chunks (iterable): Chunks as (text, file, n_tokens) tuples
+        cache (ContentEmbeddingStore): Store to look chunk texts up in
+        group_size (int): Number of chunks looked up at a time
+
+    Yields:
+        tuple: A chunk and its stored embedding, None if it is not stored
+    """
+    group = []
+    for chunk in chunks:
+        group.append(chunk)
+        if len(group) >= group_size:
+            yield from zip(group, cache.get_many([text for text, *_ in group]))
+            group = []
+    if group:
+        yield from zip(group, cache.get_many([text for text, *_ in group]))
+
+
+def embed_stream(chunks, progress=None, cache=None):
+    """A generator to embed chunks as they arrive with concurrent batched requests
+
+    Chunks are grouped into batches within embedding_batch_tokens and
+    embedding_batch_size. At most embedding_workers batches are in flight, so
+    chunks are not read much faster than they are embedded.
+
+    Args:
+        chunks (iterable): Chunks as (text, file, n_tokens) tuples
+        progress (callable, optional): Called with number of chunks embedded by each finished batch. Defaults to None.
+        cache (ContentEmbeddingStore, optional): Store to look chunks up in before embedding them and to save new embeddings to. Defaults to None.
+
+    Yields:
+        tuple: Chunks of a batch and their embeddings, batches in order of completion
+    """
+    max_batch_tokens = int(config.get(constants.EMBEDDING_BATCH_TOKENS))
+    max_batch_items = int(config.get(constants.EMBEDDING_BATCH_SIZE))
+    workers = int(config.get(constants.EMBEDDING_WORKERS))
+
+    def finished(futures, return_when):
+        done, _ = wait(futures, return_when=return_when)
+        for future in done:
+            batch = futures.pop(future)
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                logger.error(
+                    "Embedding batch of %d texts failed: %s", len(batch), e
+                )
+                continue
+            if cache is not None:
+                cache.put_many([text for text, *_ in batch], embeddings)
+            if progress is not None:
+                progress(len(batch))
+            yield batch, embeddings
+
+    if cache is not None:
+        chunks = lookup_cached(chunks, cache, max_batch_items)
+    else:
+        chunks = ((chunk, None) for chunk in chunks)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        batch = []
+        tokens_so_far = 0
+        # Chunks whose embeddings are stored are passed on without a request
+        cached = []
+        cached_embeddings = []
+        for chunk, embedding in chunks:
+            if embedding is not None:
+                cached.append(chunk)
+                cached_embeddings.append(embedding)
+                if len(cached) >= max_batch_items:
+                    if progress is not None:
+                        progress(len(cached))
+                    yield cached, cached_embeddings
+                    cached = []
+                    cached_embeddings = []
+                continue
+
+            n_tokens = chunk[2]
+            if batch and (
+                tokens_so_far + n_tokens > max_batch_tokens
+                or len(batch) >= max_batch_items
+            ):
+                futures[
+                    executor.submit(embed_batch, [text for text, *_ in batch])
+                ] = batch
+                batch = []
+                tokens_so_far = 0
+                if len(futures) >= workers:
+                    yield from finished(futures, FIRST_COMPLETED)
+            batch.append(chunk)
+            tokens_so_far += n_tokens
+        if batch:
+            futures[
+                executor.submit(embed_batch, [text for text, *_ in batch])
+            ] = batch
+        if cached:
+            if progress is not None:
+                progress(len(cached))
+            yield cached, cached_embeddings
+        yield from finished(futures, ALL_COMPLETED)
@@ -0,0 +1,666 @@
+"""A module to persist website text embeddings in a binary, memory-mapped format.
+
+Every save of a website index is written to a new version directory under the
+website directory, and CURRENT, holding the name of the version to load, is
+replaced once all files are written. Readers therefore never mix files of two
+versions. Each version directory holds:
+    embeddings.npy : A contiguous float32 matrix with one row per text chunk
+    chunks.csv     : Chunk metadata (page, number of tokens) in the same row order
+    texts.bin      : Chunk texts compressed in blocks, read only for selected chunks
+    text_offsets.npz : Offsets of blocks and texts in texts.bin
+    bm25.npz       : Optional BM25 inverted index of chunk texts
+    ivf_index.npz  : Optional approximate nearest neighbour index of large websites
+    page_index.npz : Optional index of page centroids of websites with many pages
+    quantized.npz  : Optional int8 copy of embeddings searched in memory
+    projection.npz : Optional PCA projection and reduced embeddings searched in memory
+
+Run this module as a script to migrate existing embeddings.csv files:
+    python -m src.data_collection.embedding_store
+"""
+
+import os
+import json
+import time
+import shutil
+import numpy as np
+import pandas as pd
+from src.utility.utils import config
+from src.utility import constants
+from src.utility.loggers import logger
+from src.chatbot_core.retriever import normalize_rows
+from src.chatbot_core.ivf_index import IVFIndex
+from src.chatbot_core.quantization import QuantizedVectors
+from src.chatbot_core.projection import PCAProjection
+from src.chatbot_core.bm25_index import TERMS_VERSION, BM25Index
+from src.data_collection.text_store import TextStore, TextStoreWriter
+
+
+VECTORS_FILE = "embeddings.npy"
+METADATA_FILE = "chunks.csv"
+LEGACY_CSV_FILE = "embeddings.csv"
+ANN_INDEX_FILE = "ivf_index.npz"
+PAGE_INDEX_FILE = "page_index.npz"
+QUANTIZED_FILE = "quantized.npz"
+PROJECTION_FILE = "projection.npz"
+TEXTS_FILE = "texts.bin"
+TEXT_OFFSETS_FILE = "text_offsets.npz"
+BM25_FILE = "bm25.npz"
+# Name of the version directory to load, versions are named by creation time
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "index-"
+# Files of a version, indexes saved before versions were kept directly in the website directory
+INDEX_FILES = (
+    VECTORS_FILE,
+    METADATA_FILE,
+    TEXTS_FILE,
+    TEXT_OFFSETS_FILE,
+    ANN_INDEX_FILE,
+    PAGE_INDEX_FILE,
+    QUANTIZED_FILE,
+    PROJECTION_FILE,
+    BM25_FILE,
+)
+# Rows copied at a time when converting appended vectors to .npy
+COPY_BATCH_ROWS = 65536
+
+
+class EmbeddingIndex:
+    """A class to hold chunk metadata and embedding matrix of a website"""
+
+    def __init__(
+        self,
+        domain,
+        metadata,
+        vectors,
+        version=None,
+        ann_index=None,
+        quantized=None,
+        projection=None,
+        texts=None,
+        lexical_index=None,
+        page_index=None,
+    ) -> None:
+        """A class constructor
+
+        Args:
+            domain (str): Website domain name
+            metadata (pandas dataframe): Chunk metadata with n_tokens, and text if texts is None
+            vectors (numpy array): A float32 matrix with one row per chunk
+            version (str, optional): Stored version the index was loaded from. Defaults to None.
+            ann_index (IVFIndex, optional): Approximate nearest neighbour index. Defaults to None.
+            quantized (QuantizedVectors, optional): Compact copy of vectors to search. Defaults to None.
+            projection (PCAProjection, optional): Reduced copy of vectors to search. Defaults to None.
+            texts (TextStore, optional): Compressed chunk texts. Defaults to None.
+            lexical_index (BM25Index, optional): Inverted index of chunk texts. Defaults to None.
+            page_index (IVFIndex, optional): Index with a cluster of chunks for every page. Defaults to None.
+        """
+        self.domain = domain
+        self.metadata = metadata
+        self.vectors = vectors
+        self.version = version
+        self.ann_index = ann_index
+        self.quantized = quantized
+        self.projection = projection
+        self.texts = texts
+        self.lexical_index = lexical_index
+        self.page_index = page_index
+        self.retriever = None
+        # With a compact copy only rescored rows of memory-mapped vectors are read
+        if projection is not None:
+            vectors_nbytes = projection.nbytes
+        elif quantized is not None:
+            vectors_nbytes = quantized.nbytes
+        else:
+            vectors_nbytes = vectors.nbytes
+        self.nbytes = int(
+            vectors_nbytes + metadata.memory_usage(deep=True).sum()
+        )
+        for coarse_index in (ann_index, page_index):
+            if coarse_index is not None:
+                self.nbytes += int(
+                    coarse_index.centroids.nbytes + coarse_index.rows.nbytes
+                )
+        # Compressed texts stay memory-mapped, only their offsets are counted
+        if texts is not None:
+            self.nbytes += texts.nbytes
+        if lexical_index is not None:
+            self.nbytes += lexical_index.nbytes
+
+    def __len__(self):
+        """Number of chunks in the index"""
+        return len(self.metadata)
+
+    def chunk_texts(self, rows):
+        """A method to get texts of chunks
+
+        Args:
+            rows (array like): Row numbers of chunks
+
+        Returns:
+            list: Texts in order of rows
+        """
+        if self.texts is None:
+            return self.metadata["text"].values[rows].tolist()
+        return self.texts.get(rows)
+
+
+class EmbeddingStore:
+    """A class to save and load embeddings of a website"""
+
+    def __init__(self, local_domain) -> None:
+        """A class constructor
+
+        Args:
+            local_domain (str): Website domain name
+        """
+        self.local_domain = local_domain
+        self.directory = (
+            config.get(constants.EMBEDDINGS_DATA_PATH) + local_domain + "/"
+        )
+
+    def path(self, file_name):
+        """A method to get full path of a file in website directory
+
+        Args:
+            file_name (str): A file name
+
+        Returns:
+            str: Full file path
+        """
+        return self.directory + file_name
+
+    def version_path(self, version, file_name):
+        """A method to get full path of a file of a stored version
+
+        Args:
+            version (str): Version name, empty for an index saved before versions
+            file_name (str): A file name
+
+        Returns:
+            str: Full file path
+        """
+        if not version:
+            return self.path(file_name)
+        return self.directory + version + "/" + file_name
+
+    def current_version(self):
+        """A method to get the stored version to load
+
+        Returns:
+            str: Version name, empty for an index saved before versions, None if no index is stored
+        """
+        try:
+            with open(self.path(CURRENT_FILE), encoding="UTF-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            pass
+        if os.path.exists(self.path(VECTORS_FILE)) and os.path.exists(
+            self.path(METADATA_FILE)
+        ):
+            return ""
+        return None
+
+    def exists(self):
+        """A method to check if binary embeddings are stored
+
+        Returns:
+            bool: True if a version with vectors and metadata is stored
+        """
+        return self.current_version() is not None
+
+    def new_version(self):
+        """A method to create an empty version directory, not loaded until committed
+
+        Returns:
+            str: Version name
+        """
+        version = VERSION_PREFIX + str(time.time_ns())
+        os.makedirs(self.directory + version)
+        return version
+
+    def commit_version(self, version):
+        """A method to make a written version the one to load
+
+        CURRENT is replaced in one step. The previous version is kept for readers
+        still using it, older ones are removed.
+
+        Args:
+            version (str): Version name
+        """
+        previous = self.current_version()
+        current_tmp = tmp_path(self.path(CURRENT_FILE))
+        with open(current_tmp, "w", encoding="UTF-8") as f:
+            f.write(version)
+        os.replace(current_tmp, self.path(CURRENT_FILE))
+
+        for name in os.listdir(self.directory):
+            if name.startswith(VERSION_PREFIX) and name not in (
+                version,
+                previous,
+            ):
+                shutil.rmtree(self.directory + name, ignore_errors=True)
+        if previous:
+            # Files of an index saved before versions
+            for file_name in INDEX_FILES:
+                if os.path.exists(self.path(file_name)):
+                    os.remove(self.path(file_name))
+
+    def remove_version(self, version):
+        """A method to remove an uncommitted version
+
+        Args:
+            version (str): Version name
+        """
+        shutil.rmtree(self.directory + version, ignore_errors=True)
+
+    def has_legacy_csv(self):
+        """A method to check if old embeddings.csv file exists
+
+        Returns:
+            bool: True if embeddings.csv exists
+        """
+        return os.path.exists(self.path(LEGACY_CSV_FILE))
+
+    def text_writer(self, version):
+        """A method to get a writer of compressed chunk texts of a version
+
+        Args:
+            version (str): Version name
+
+        Returns:
+            TextStoreWriter: A writer, saving texts when closed
+        """
+        return TextStoreWriter(
+            self.version_path(version, TEXTS_FILE),
+            self.version_path(version, TEXT_OFFSETS_FILE),
+        )
+
+    def save(self, metadata, vectors):
+        """A method to save chunk metadata, texts and embedding matrix
+
+        Vectors are stored normalized to unit length and texts compressed apart
+        from metadata. Files are written to a new version, which replaces the
+        stored index once complete.
+
+        Args:
+            metadata (pandas dataframe): Chunk metadata with text and n_tokens
+            vectors (numpy array or list): Embeddings, one row per chunk
+        """
+        vectors = np.ascontiguousarray(
+            normalize_rows(vectors), dtype=np.float32
+        )
+        if len(vectors) != len(metadata):
+            raise ValueError(
+                "Number of vectors does not match number of chunks"
+            )
+        os.makedirs(self.directory, exist_ok=True)
+
+        version = self.new_version()
+        try:
+            with open(self.version_path(version, VECTORS_FILE), "wb") as f:
+                np.save(f, vectors)
+            metadata.drop(columns=["text"]).reset_index(drop=True).to_csv(
+                self.version_path(version, METADATA_FILE)
+            )
+            text_writer = self.text_writer(version)
+            text_writer.append(metadata["text"])
+            text_writer.close()
+        except BaseException:
+            self.remove_version(version)
+            raise
+        # Search indexes are built again for the new version
+        self.commit_version(version)
+        logger.info(
+            "Saved %d embeddings for %s", len(vectors), self.local_domain
+        )
+
+    def writer(self):
+        """A method to get a writer appending chunks to a new index of the website
+
+        Returns:
+            EmbeddingWriter: A writer, saving the index when closed
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return EmbeddingWriter(self)
+
+    def save_dataframe(self, df):
+        """A method to save a dataframe having an embeddings column
+
+        Args:
+            df (pandas dataframe): Chunks with text, n_tokens and embeddings
+        """
+        vectors = np.array(df["embeddings"].tolist(), dtype=np.float32)
+        self.save(df.drop(columns=["embeddings"]), vectors)
+
+    def load(self):
+        """A method to load the current version with a memory-mapped embedding matrix
+
+        Returns:
+            EmbeddingIndex: Chunk metadata and embeddings of the website
+        """
+        version = self.current_version()
+        if version is None:
+            raise FileNotFoundError(
+                "No embeddings are stored for " + self.local_domain
+            )
+
+        def path(file_name):
+            return self.version_path(version, file_name)
+
+        vectors = np.load(path(VECTORS_FILE), mmap_mode="r")
+        metadata = pd.read_csv(path(METADATA_FILE), index_col=0)
+        texts = None
+        if os.path.exists(path(TEXT_OFFSETS_FILE)):
+            texts = TextStore.load(path(TEXTS_FILE), path(TEXT_OFFSETS_FILE))
+        ann_index = None
+        if os.path.exists(path(ANN_INDEX_FILE)):
+            ann_index = IVFIndex.load(path(ANN_INDEX_FILE))
+        page_index = None
+        if os.path.exists(path(PAGE_INDEX_FILE)):
+            page_index = IVFIndex.load(path(PAGE_INDEX_FILE))
+        quantized = None
+        if os.path.exists(path(QUANTIZED_FILE)):
+            quantized = QuantizedVectors.load(path(QUANTIZED_FILE))
+        projection = None
+        if os.path.exists(path(PROJECTION_FILE)):
+            projection = PCAProjection.load(path(PROJECTION_FILE))
+        lexical_index = None
+        if os.path.exists(path(BM25_FILE)):
+            lexical_index = BM25Index.load(path(BM25_FILE))
+            if lexical_index.terms_version != TERMS_VERSION:
+                # Built again by DataProcessor.get_embeddings
+                lexical_index = None
+        return EmbeddingIndex(
+            self.local_domain,
+            metadata,
+            vectors,
+            version=version,
+            ann_index=ann_index,
+            quantized=quantized,
+            projection=projection,
+            texts=texts,
+            lexical_index=lexical_index,
+            page_index=page_index,
+        )
+
+    def compress_texts(self):
+        """A method to move chunk texts of an index saved before texts were compressed out of chunks.csv
+
+        Other files of the current version are linked into a new version.
+        """
+        previous = self.current_version()
+        metadata = pd.read_csv(
+            self.version_path(previous, METADATA_FILE), index_col=0
+        )
+        if "text" not in metadata.columns:
+            return
+        version = self.new_version()
+        try:
+            text_writer = self.text_writer(version)
+            text_writer.append(metadata["text"].fillna(""))
+            text_writer.close()
+            metadata.drop(columns=["text"]).to_csv(
+                self.version_path(version, METADATA_FILE)
+            )
+            for file_name in INDEX_FILES:
+                source = self.version_path(previous, file_name)
+                target = self.version_path(version, file_name)
+                if os.path.exists(source) and not os.path.exists(target):
+                    link_or_copy(source, target)
+        except BaseException:
+            self.remove_version(version)
+            raise
+        self.commit_version(version)
+        logger.info("Compressed chunk texts of %s", self.local_domain)
+
+    def save_ann_index(self, ann_index, version):
+        """A method to save approximate nearest neighbour index of the website
+
+        Args:
+            ann_index (IVFIndex): Index built over stored vectors
+            version (str): Version it was built from
+        """
+        ann_tmp = tmp_path(self.version_path(version, ANN_INDEX_FILE))
+        ann_index.save(ann_tmp)
+        os.replace(ann_tmp, self.version_path(version, ANN_INDEX_FILE))
+        # Only one index narrows down chunks to score
+        if os.path.exists(self.version_path(version, PAGE_INDEX_FILE)):
+            os.remove(self.version_path(version, PAGE_INDEX_FILE))
+        logger.info(
+            "Saved IVF index with %d clusters for %s",
+            ann_index.nlist,
+            self.local_domain,
+        )
+
+    def save_page_index(self, page_index, version):
+        """A method to save page centroids index of the website
+
+        Args:
+            page_index (IVFIndex): Index with a cluster of chunks for every page
+            version (str): Version it was built from
+        """
+        page_tmp = tmp_path(self.version_path(version, PAGE_INDEX_FILE))
+        page_index.save(page_tmp)
+        os.replace(page_tmp, self.version_path(version, PAGE_INDEX_FILE))
+        if os.path.exists(self.version_path(version, ANN_INDEX_FILE)):
+            os.remove(self.version_path(version, ANN_INDEX_FILE))
+        logger.info(
+            "Saved page index with %d pages for %s",
+            page_index.nlist,
+            self.local_domain,
+        )
+
+    def save_lexical_index(self, lexical_index, version):
+        """A method to save BM25 inverted index of the website
+
+        Args:
+            lexical_index (BM25Index): Index built over stored texts
+            version (str): Version it was built from
+        """
+        bm25_tmp = tmp_path(self.version_path(version, BM25_FILE))
+        lexical_index.save(bm25_tmp)
+        os.replace(bm25_tmp, self.version_path(version, BM25_FILE))
+        logger.info(
+            "Saved BM25 index with %d terms for %s",
+            len(lexical_index.terms),
+            self.local_domain,
+        )
+
+    def save_quantized(self, quantized, version):
+        """A method to save quantized copy of the website vectors
+
+        Args:
+            quantized (QuantizedVectors): Quantized stored vectors
+            version (str): Version it was built from
+        """
+        quantized_tmp = tmp_path(self.version_path(version, QUANTIZED_FILE))
+        quantized.save(quantized_tmp)
+        os.replace(quantized_tmp, self.version_path(version, QUANTIZED_FILE))
+        # Only one compact copy of vectors is searched
+        if os.path.exists(self.version_path(version, PROJECTION_FILE)):
+            os.remove(self.version_path(version, PROJECTION_FILE))
+        logger.info(
+            "Saved %s vectors for %s", quantized.dtype, self.local_domain
+        )
+
+    def save_projection(self, projection, version):
+        """A method to save projection and reduced copy of the website vectors
+
+        Args:
+            projection (PCAProjection): Projection fitted to stored vectors
+            version (str): Version it was built from
+        """
+        projection_tmp = tmp_path(self.version_path(version, PROJECTION_FILE))
+        projection.save(projection_tmp)
+        os.replace(projection_tmp, self.version_path(version, PROJECTION_FILE))
+        if os.path.exists(self.version_path(version, QUANTIZED_FILE)):
+            os.remove(self.version_path(version, QUANTIZED_FILE))
+        logger.info(
+            "Saved %d dimensional projection for %s",
+            projection.dimensions,
+            self.local_domain,
+        )
+
+    def migrate_csv(self, remove_csv=False):
+        """A method to convert an old embeddings.csv to binary format
+
+        Args:
+            remove_csv (bool, optional): Delete csv after migration. Defaults to False.
+        """
+        df = pd.read_csv(self.path(LEGACY_CSV_FILE), index_col=0)
+        df["embeddings"] = df["embeddings"].apply(json.loads)
+        self.save_dataframe(df)
+        if remove_csv:
+            os.remove(self.path(LEGACY_CSV_FILE))
+        logger.info("Migrated embeddings.csv of %s", self.local_domain)
+
+
+class EmbeddingWriter:
+    """A class to save an index of a website chunk by chunk
+
+    Vectors are appended to a raw float32 file, texts to compressed blocks and
+    metadata rows to a csv file, so memory use does not grow with the website.
+    On close the raw file is copied to .npy in blocks and the new version
+    replaces the stored index.
+    """
+
+    def __init__(self, store) -> None:
+        """A class constructor
+
+        Args:
+            store (EmbeddingStore): Store of the website
+        """
+        self.store = store
+        self.count = 0
+        self.dimensions = None
+        self.version = store.new_version()
+        self.raw_path = store.version_path(self.version, VECTORS_FILE + ".raw")
+        self.metadata_path = store.version_path(self.version, METADATA_FILE)
+        self._raw_file = open(self.raw_path, "wb")
+        self._text_writer = store.text_writer(self.version)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, metadata, vectors):
+        """A method to append chunks to the index
+
+        Args:
+            metadata (pandas dataframe): Chunk metadata with text and n_tokens
+            vectors (numpy array or list): Embeddings, one row per chunk
+        """
+        if len(metadata) == 0:
+            return
+        vectors = np.ascontiguousarray(
+            normalize_rows(vectors), dtype=np.float32
+        )
+        if len(vectors) != len(metadata):
+            raise ValueError(
+                "Number of vectors does not match number of chunks"
+            )
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError("Embeddings have different dimensions")
+
+        vectors.tofile(self._raw_file)
+        self._text_writer.append(metadata["text"])
+        metadata = metadata.drop(columns=["text"]).reset_index(drop=True)
+        metadata.index = metadata.index + self.count
+        metadata.to_csv(self.metadata_path, mode="a", header=self.count == 0)
+        self.count += len(metadata)
+
+    def close(self):
+        """A method to save appended chunks as the index of the website"""
+        self._raw_file.close()
+        if self.count == 0:
+            self.abort()
+            raise ValueError(
+                "No chunks were embedded for " + self.store.local_domain
+            )
+
+        raw = np.memmap(
+            self.raw_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(self.count, self.dimensions),
+        )
+        vectors = np.lib.format.open_memmap(
+            self.store.version_path(self.version, VECTORS_FILE),
+            mode="w+",
+            dtype=np.float32,
+            shape=(self.count, self.dimensions),
+        )
+        for start in range(0, self.count, COPY_BATCH_ROWS):
+            vectors[start : start + COPY_BATCH_ROWS] = raw[
+                start : start + COPY_BATCH_ROWS
+            ]
+        vectors.flush()
+        del vectors, raw
+        os.remove(self.raw_path)
+
+        self._text_writer.close()
+        self.store.commit_version(self.version)
+        logger.info(
+            "Saved %d embeddings for %s", self.count, self.store.local_domain
+        )
+
+    def abort(self):
+        """A method to discard appended chunks"""
+        self._raw_file.close()
+        self._text_writer.abort()
+        self.store.remove_version(self.version)
+
+
+def tmp_path(path):
+    """A method to get a temporary path to write a file before renaming it
+
+    Indexes of a version may be built by the server and a refresh at once, so
+    the path is unique per process.
+
+    Args:
+        path (str): Final file path
+
+    Returns:
+        str: Temporary file path
+    """
+    return path + "." + str(os.getpid()) + ".tmp"
+
+
+def link_or_copy(source, target):
+    """A method to hard link a file, copying it where links are not supported
+
+    Args:
+        source (str): Existing file path
+        target (str): New file path
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def migrate_all(remove_csv=False):
+    """A method to migrate embeddings.csv of all websites to binary format
+
+    Args:
+        remove_csv (bool, optional): Delete csv files after migration. Defaults to False.
+    """
+    data_path = config.get(constants.EMBEDDINGS_DATA_PATH)
+    if not os.path.exists(data_path):
+        return
+    for local_domain in os.listdir(data_path):
+        store = EmbeddingStore(local_domain)
+        if store.has_legacy_csv() and not store.exists():
+            logger.info("Migrating embeddings.csv of %s", local_domain)
+            store.migrate_csv(remove_csv=remove_csv)
+
+
+if __name__ == "__main__":
+    migrate_all()
@@ -0,0 +1,134 @@
+"""A module to keep loaded website indexes in memory across queries.
+"""
+
+import threading
+from collections import OrderedDict
+from src.utility.loggers import logger
+
+
+class IndexCache:
+    """A thread-safe LRU cache of website indexes bounded by a memory budget"""
+
+    def __init__(self, memory_budget) -> None:
+        """A class constructor
+
+        Args:
+            memory_budget (int): Maximum bytes of indexes to keep loaded
+        """
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self._indexes = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, domain, loader, current_version=None):
+        """A method to get index of a domain, loading it on a cache miss
+
+        Args:
+            domain (str): Website domain name
+            loader (callable): A function returning EmbeddingIndex of the domain
+            current_version (callable, optional): A function returning stored version of the domain,
+                a loaded index of another version is loaded again. Defaults to None.
+
+        Returns:
+            EmbeddingIndex: Index of the domain
+        """
+        # Index may be saved again by another process, e.g. a nightly refresh
+        version = current_version() if current_version is not None else None
+
+        def is_current(index):
+            return version is None or index.version == version
+
+        with self._lock:
+            index = self._indexes.get(domain)
+            if index is not None and is_current(index):
+                self._indexes.move_to_end(domain)
+                self.hits += 1
+                return index
+            self.misses += 1
+            load_lock = self._load_locks.setdefault(domain, threading.Lock())
+
+        # Concurrent misses for the same domain load the index only once
+        with load_lock:
+            with self._lock:
+                index = self._indexes.get(domain)
+            if index is None or not is_current(index):
+                if index is not None:
+                    logger.info(
+                        "Reloading index of %s, stored version changed", domain
+                    )
+                    with self._lock:
+                        self.reloads += 1
+                index = loader()
+                self.put(domain, index)
+        return index
+
+    def contains(self, domain):
+        """A method to check if index of a domain is loaded
+
+        Args:
+            domain (str): Website domain name
+
+        Returns:
+            bool: True if index is in cache
+        """
+        with self._lock:
+            return domain in self._indexes
+
+    def put(self, domain, index):
+        """A method to add index of a domain and evict least recently used ones
+
+        The most recently added index is always kept, even if it alone is larger
+        than memory budget.
+
+        Args:
+            domain (str): Website domain name
+            index (EmbeddingIndex): Index of the domain
+        """
+        with self._lock:
+            old_index = self._indexes.pop(domain, None)
+            if old_index is not None:
+                self.memory_used -= old_index.nbytes
+            self._indexes[domain] = index
+            self.memory_used += index.nbytes
+
+            while (
+                self.memory_used > self.memory_budget
+                and len(self._indexes) > 1
+            ):
+                evicted_domain, evicted = self._indexes.popitem(last=False)
+                self.memory_used -= evicted.nbytes
+                self.evictions += 1
+                logger.info("Evicted index of %s from cache", evicted_domain)
+
+    def invalidate(self, domain):
+        """A method to remove index of a domain, e.g. after it is rebuilt
+
+        Args:
+            domain (str): Website domain name
+        """
+        with self._lock:
+            index = self._indexes.pop(domain, None)
+            if index is not None:
+                self.memory_used -= index.nbytes
+
+    def stats(self):
+        """A method to get cache counters
+
+        Returns:
+            dict: Hits, misses, evictions, reloads and memory usage of the cache
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+                "indexes": len(self._indexes),
+                "memory_used": self.memory_used,
+                "memory_budget": self.memory_budget,
+            }
@@ -0,0 +1,150 @@
+"""A module to crawl and embed websites in background jobs
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.utility.loggers import logger
+
+
+QUEUED = "queued"
+CRAWLING = "crawling"
+EMBEDDING = "embedding"
+READY = "ready"
+FAILED = "failed"
+
+
+class IngestionJob:
+    """A class to hold status and progress of indexing a website"""
+
+    def __init__(self, domain, url) -> None:
+        """A class constructor
+
+        Args:
+            domain (str): Website domain name
+            url (str): Full website URL
+        """
+        self.domain = domain
+        self.url = url
+        self.status = QUEUED
+        self.pages_crawled = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        # Tokens of text repeated across pages, not chunked
+        self.tokens_removed = 0
+        # Chunks nearly identical to an earlier chunk, not embedded
+        self.duplicate_chunks = 0
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def set_status(self, status):
+        """A method to set job status
+
+        Args:
+            status (str): One of queued, crawling, embedding, ready or failed
+        """
+        self.status = status
+        if status in (READY, FAILED):
+            self.finished = time.time()
+
+    def add_page(self, *_):
+        """A method to count a crawled page"""
+        self.pages_crawled += 1
+
+    def add_chunks_total(self, n_chunks):
+        """A method to count chunks to embed, while website is still crawled
+
+        Args:
+            n_chunks (int): Number of new chunks
+        """
+        self.chunks_total += n_chunks
+
+    def add_chunks(self, n_chunks):
+        """A method to count embedded chunks
+
+        Args:
+            n_chunks (int): Number of chunks embedded
+        """
+        self.chunks_embedded += n_chunks
+
+    @property
+    def done(self):
+        """True if job is finished, successfully or not"""
+        return self.status in (READY, FAILED)
+
+    def to_dict(self):
+        """A method to get job status for API responses
+
+        Returns:
+            dict: Job status and progress
+        """
+        return {
+            "website": self.url,
+            "status": self.status,
+            "pages_crawled": self.pages_crawled,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "tokens_removed": self.tokens_removed,
+            "duplicate_chunks": self.duplicate_chunks,
+            "error": self.error,
+        }
+
+
+class IngestionJobManager:
+    """A class to run website indexing jobs on a bounded pool of threads"""
+
+    def __init__(self, max_workers) -> None:
+        """A class constructor
+
+        Args:
+            max_workers (int): Maximum websites indexed at the same time
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingestion"
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, domain, url, task):
+        """A method to start indexing a website unless it is already running
+
+        Args:
+            domain (str): Website domain name
+            url (str): Full website URL
+            task (callable): A function indexing the website, called with the job
+
+        Returns:
+            IngestionJob: New or already running job of the website
+        """
+        with self._lock:
+            job = self._jobs.get(domain)
+            if job is not None and not job.done:
+                return job
+            job = IngestionJob(domain, url)
+            self._jobs[domain] = job
+        self._executor.submit(self._run, job, task)
+        return job
+
+    def get(self, domain):
+        """A method to get latest job of a website
+
+        Args:
+            domain (str): Website domain name
+
+        Returns:
+            IngestionJob: Latest job, None if website was never submitted
+        """
+        with self._lock:
+            return self._jobs.get(domain)
+
+    @staticmethod
+    def _run(job, task):
+        try:
+            task(job)
+            job.set_status(READY)
+            logger.info("Indexed website %s", job.url)
+        except Exception as e:
+            job.error = str(e)
+            job.set_status(FAILED)
+            logger.error("Indexing of %s failed: %s", job.url, e)
@@ -0,0 +1,129 @@
+"""A module to find near-duplicate text chunks with MinHash and LSH
+
+Each chunk gets a MinHash signature of its word shingles. Signatures are split
+into bands and chunks sharing a band are compared, so a chunk is only compared
+to likely duplicates instead of to every chunk seen before.
+"""
+
+import zlib
+import numpy as np
+
+
+# Number of consecutive words in a shingle
+SHINGLE_SIZE = 5
+# Mersenne prime 2^61 - 1 of the universal hash functions
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """A method to get hashes of word shingles of a text
+
+    Args:
+        text (str): A text
+        size (int, optional): Words in a shingle. Defaults to 5.
+
+    Returns:
+        numpy array: Distinct 32 bit shingle hashes
+    """
+    words = text.lower().split()
+    shingles = {
+        " ".join(words[start : start + size])
+        for start in range(max(len(words) - size + 1, 1))
+    }
+    return np.array(
+        [zlib.crc32(shingle.encode("UTF-8")) for shingle in shingles],
+        dtype=np.uint64,
+    )
+
+
+def lsh_bands(threshold, num_perm):
+    """A method to choose number of bands for a similarity threshold
+
+    A pair of chunks with similarity s shares a band with probability
+    1 - (1 - s^rows)^bands, which rises steeply around (1 / bands)^(1 / rows).
+
+    Args:
+        threshold (float): Jaccard similarity of near-duplicates
+        num_perm (int): Signature length
+
+    Returns:
+        int: Number of bands, a divisor of num_perm
+    """
+    divisors = [
+        bands for bands in range(1, num_perm + 1) if num_perm % bands == 0
+    ]
+    return min(
+        divisors,
+        key=lambda bands: abs((1 / bands) ** (bands / num_perm) - threshold),
+    )
+
+
+class NearDuplicateIndex:
+    """A class to detect chunks nearly identical to a chunk added before"""
+
+    def __init__(self, threshold, num_perm=128, seed=0) -> None:
+        """A class constructor
+
+        Args:
+            threshold (float): Minimum estimated Jaccard similarity of near-duplicates
+            num_perm (int, optional): Number of hash functions of a signature. Defaults to 128.
+            seed (int, optional): Seed of hash functions. Defaults to 0.
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = lsh_bands(threshold, num_perm)
+        self.rows = num_perm // self.bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self.duplicates = 0
+
+    def signature(self, text):
+        """A method to get MinHash signature of a text
+
+        Args:
+            text (str): A text
+
+        Returns:
+            numpy array: num_perm minimum hashes
+        """
+        hashes = shingle_hashes(text)
+        permuted = (
+            (hashes[:, np.newaxis] * self._a + self._b) % MERSENNE_PRIME
+        ) & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def add(self, text):
+        """A method to add a text unless it is a near-duplicate of an added one
+
+        Args:
+            text (str): A chunk text
+
+        Returns:
+            bool: True if text is a near-duplicate and was not added
+        """
+        signature = self.signature(text)
+        keys = [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+        candidates = set()
+        for buckets, key in zip(self._buckets, keys):
+            candidates.update(buckets.get(key, ()))
+        for candidate in candidates:
+            if (
+                np.mean(self._signatures[candidate] == signature)
+                >= self.threshold
+            ):
+                self.duplicates += 1
+                return True
+
+        position = len(self._signatures)
+        self._signatures.append(signature)
+        for buckets, key in zip(self._buckets, keys):
+            buckets.setdefault(key, []).append(position)
+        return False
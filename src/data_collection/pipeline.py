@@ -0,0 +1,72 @@
+"""A module to run ingestion stages concurrently as a pipeline of generators
+
+Each stage is a generator consuming the previous one. threaded runs a stage in
+its own thread and hands items over through a bounded queue, so all stages
+work at the same time and a slow stage holds back the ones before it.
+"""
+
+import queue
+import threading
+
+
+_END = object()
+
+
+class _Failure:
+    """A class to pass an exception of a stage to its consumer"""
+
+    def __init__(self, error) -> None:
+        self.error = error
+
+
+def threaded(iterable, queue_size):
+    """A generator to iterate an iterable in a background thread
+
+    Args:
+        iterable (iterable): A stage, usually a generator
+        queue_size (int): Maximum items produced ahead of the consumer
+
+    Yields:
+        object: Items of the iterable, in order
+
+    Raises:
+        Exception: Exception raised by the iterable
+    """
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer is gone, instead of blocking forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,183 @@
+"""A module to store chunk texts of a website compressed, apart from the embeddings
+
+Texts are compressed with zlib in blocks of BLOCK_ROWS consecutive chunks and
+written one after another to texts.bin, which is memory-mapped on load. Byte
+offsets of every block and of every text in its block are kept in
+text_offsets.npz, so only the blocks of chunks selected for a context are read
+and decompressed.
+"""
+
+import os
+import zlib
+import numpy as np
+
+
+# Chunks compressed together, more compress better and read slower
+BLOCK_ROWS = 16
+COMPRESSION_LEVEL = 6
+
+
+class TextStore:
+    """A class to read chunk texts from compressed blocks"""
+
+    def __init__(
+        self, blocks, block_offsets, starts, ends, block_rows
+    ) -> None:
+        """A class constructor
+
+        Args:
+            blocks (numpy array): Compressed blocks as bytes, usually memory-mapped
+            block_offsets (numpy array): Start of every block in blocks, plus the end
+            starts (numpy array): Start of every text in its decompressed block
+            ends (numpy array): End of every text in its decompressed block
+            block_rows (int): Chunks per block
+        """
+        self.blocks = blocks
+        self.block_offsets = block_offsets
+        self.starts = starts
+        self.ends = ends
+        self.block_rows = block_rows
+
+    def __len__(self):
+        """Number of texts"""
+        return len(self.starts)
+
+    @property
+    def nbytes(self):
+        """Bytes of offsets kept in memory"""
+        return (
+            self.block_offsets.nbytes + self.starts.nbytes + self.ends.nbytes
+        )
+
+    def block(self, block):
+        """A method to decompress a block
+
+        Args:
+            block (int): Block number
+
+        Returns:
+            bytes: UTF-8 texts of the block
+        """
+        return zlib.decompress(
+            self.blocks[
+                self.block_offsets[block] : self.block_offsets[block + 1]
+            ].tobytes()
+        )
+
+    def get(self, rows):
+        """A method to get texts of chunks, decompressing every block once
+
+        Args:
+            rows (array like): Row numbers of chunks
+
+        Returns:
+            list: Texts in order of rows
+        """
+        blocks = {}
+        texts = []
+        for row in rows:
+            block = int(row) // self.block_rows
+            if block not in blocks:
+                blocks[block] = self.block(block)
+            texts.append(
+                blocks[block][self.starts[row] : self.ends[row]].decode(
+                    "UTF-8"
+                )
+            )
+        return texts
+
+    @classmethod
+    def load(cls, blocks_path, offsets_path):
+        """A method to load offsets and memory-map compressed blocks
+
+        Args:
+            blocks_path (str): Path of compressed blocks file
+            offsets_path (str): Path of offsets .npz file
+
+        Returns:
+            TextStore: Stored texts
+        """
+        with np.load(offsets_path) as offsets:
+            block_offsets = offsets["block_offsets"]
+            starts = offsets["starts"]
+            ends = offsets["ends"]
+            block_rows = int(offsets["block_rows"])
+        if block_offsets[-1] > 0:
+            blocks = np.memmap(blocks_path, dtype=np.uint8, mode="r")
+        else:
+            # An empty file can not be memory-mapped
+            blocks = np.empty(0, dtype=np.uint8)
+        return cls(blocks, block_offsets, starts, ends, block_rows)
+
+
+class TextStoreWriter:
+    """A class to write chunk texts to compressed blocks as they come"""
+
+    def __init__(
+        self, blocks_path, offsets_path, block_rows=BLOCK_ROWS
+    ) -> None:
+        """A class constructor
+
+        Files are written to temporary paths and renamed on close.
+
+        Args:
+            blocks_path (str): Path of compressed blocks file
+            offsets_path (str): Path of offsets .npz file
+            block_rows (int, optional): Chunks per block. Defaults to 16.
+        """
+        self.blocks_path = blocks_path
+        self.offsets_path = offsets_path
+        self.block_rows = block_rows
+        self.blocks_tmp = blocks_path + ".tmp"
+        self.offsets_tmp = offsets_path + ".tmp"
+        self._file = open(self.blocks_tmp, "wb")
+        self._pending = []
+        self._block_offsets = [0]
+        self._starts = []
+        self._ends = []
+
+    def append(self, texts):
+        """A method to append texts
+
+        Args:
+            texts (iterable): Chunk texts
+        """
+        for text in texts:
+            self._pending.append(str(text).encode("UTF-8"))
+            if len(self._pending) == self.block_rows:
+                self._write_block()
+
+    def _write_block(self):
+        """A method to compress and write pending texts as one block"""
+        end = 0
+        for text in self._pending:
+            self._starts.append(end)
+            end += len(text)
+            self._ends.append(end)
+        compressed = zlib.compress(b"".join(self._pending), COMPRESSION_LEVEL)
+        self._file.write(compressed)
+        self._block_offsets.append(self._block_offsets[-1] + len(compressed))
+        self._pending = []
+
+    def close(self):
+        """A method to write remaining texts and offsets, replacing stored texts"""
+        if self._pending:
+            self._write_block()
+        self._file.close()
+        with open(self.offsets_tmp, "wb") as f:
+            np.savez(
+                f,
+                block_offsets=np.array(self._block_offsets, dtype=np.int64),
+                starts=np.array(self._starts, dtype=np.int32),
+                ends=np.array(self._ends, dtype=np.int32),
+                block_rows=np.array(self.block_rows),
+            )
+        os.replace(self.blocks_tmp, self.blocks_path)
+        os.replace(self.offsets_tmp, self.offsets_path)
+
+    def abort(self):
+        """A method to discard appended texts"""
+        self._file.close()
+        for path in (self.blocks_tmp, self.offsets_tmp):
+            if os.path.exists(path):
+                os.remove(path)
@@ -4,18 +4,38 @@
 from html.parser import HTMLParser
 import requests
 import re
-import urllib.request
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 import os
-from collections import deque
+import json
+import hashlib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from src.utility.nlp_text_cleaner import remove_unicode
+from src.data_collection.crawl_frontier import (
+    USER_AGENT,
+    CrawlFrontier,
+    iter_sitemap_pages,
+    link_score,
+    load_robots,
+    read_body,
+    sitemap_score,
+)
 from src.utility.utils import config
 from src.utility import constants
 
 # Regex pattern to match a URL
 HTTP_URL_PATTERN = r"^http[s]*://.+"
 
+# Query parameters which do not change page content
+TRACKING_PARAMETERS = {"gclid", "fbclid", "msclkid", "mc_cid", "mc_eid"}
+# Last path segments served as the directory page
+INDEX_PAGES = {"index.html", "index.htm", "index.php", "default.aspx"}
+DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+# Statuses of pages removed from the website, other errors may be temporary
+GONE_STATUS_CODES = (404, 410)
+
 
 class HyperlinkParser(HTMLParser):
     """A class to parse the HTML and get the hyperlinks
@@ -45,29 +65,15 @@ class HyperlinkParser(HTMLParser):
             self.hyperlinks.append(attrs["href"])
 
 
-def get_hyperlinks(url):
-    """A method to get the hyperlinks from a URL
+def parse_hyperlinks(html):
+    """A method to get the hyperlinks from HTML text
 
     Args:
-        url (str): A website URL
+        html (str): HTML of a page
 
     Returns:
         hyperlinks (list): A list of hyperlinks
     """
-    # Try to open the URL and read the HTML
-    try:
-        # Open the URL and read the HTML
-        with urllib.request.urlopen(url) as response:
-            # If the response is not HTML, return an empty list
-            if not response.info().get("Content-Type").startswith("text/html"):
-                return []
-
-            # Decode the HTML
-            html = response.read().decode("utf-8")
-    except Exception as e:
-        print(e)
-        return []
-
     # Create the HTML Parser and then Parse the HTML to get hyperlinks
     parser = HyperlinkParser()
     parser.feed(html)
@@ -75,25 +81,62 @@ def get_hyperlinks(url):
     return parser.hyperlinks
 
 
-def get_domain_hyperlinks(local_domain, url):
-    """A method to get the hyperlinks from a URL that are within the same domain
+def canonicalize_url(url):
+    """A method to get one URL for all variants of a page URL
+
+    Scheme and host are lower cased, default ports, fragments, tracking
+    parameters(utm_*, gclid, ...) and index pages(index.html, ...) are removed,
+    remaining query parameters are sorted and the trailing slash is removed.
+    Path case is kept, as servers may treat it as case sensitive.
+
+    Args:
+        url (str): A page URL
+
+    Returns:
+        str: Canonical URL
+    """
+    url_obj = urlparse(url)
+    scheme = url_obj.scheme.lower()
+    netloc = url_obj.netloc.lower()
+    if netloc.endswith(DEFAULT_PORTS.get(scheme, "")):
+        netloc = netloc[: len(netloc) - len(DEFAULT_PORTS.get(scheme, ""))]
+
+    path = url_obj.path
+    directory, _, last_segment = path.rpartition("/")
+    if last_segment.lower() in INDEX_PAGES:
+        path = directory
+    path = path.rstrip("/")
+
+    query = urlencode(
+        sorted(
+            (name, value)
+            for name, value in parse_qsl(url_obj.query, keep_blank_values=True)
+            if not name.lower().startswith("utm_")
+            and name.lower() not in TRACKING_PARAMETERS
+        )
+    )
+    return urlunparse((scheme, netloc, path, url_obj.params, query, ""))
+
+
+def clean_domain_hyperlinks(local_domain, hyperlinks):
+    """A method to keep the hyperlinks that are within the same domain
 
     Args:
         local_domain (str): only domain name of URL
-        url (str): A complete website URL
+        hyperlinks (list): A list of hyperlinks found on a page
 
     Returns:
-        clean links(list): A list of links within the same domain
+        clean links(list): A list of canonical links within the same domain
     """
     clean_links = []
-    for link in set(get_hyperlinks(url)):
+    for link in set(hyperlinks):
         clean_link = None
 
         # If the link is a URL, check if it is within the same domain
         if re.search(HTTP_URL_PATTERN, link):
             # Parse the URL and check if the domain is the same
             url_obj = urlparse(link)
-            if url_obj.netloc == local_domain:
+            if url_obj.netloc.lower() == local_domain.lower():
                 clean_link = link
 
         # If the link is not a URL, check if it is a relative link
@@ -105,28 +148,367 @@ def get_domain_hyperlinks(local_domain, url):
             clean_link = "https://" + local_domain + "/" + link
 
         if clean_link is not None:
-            if clean_link.endswith("/"):
-                clean_link = clean_link[:-1]
-            clean_links.append(clean_link)
+            clean_links.append(canonicalize_url(clean_link))
 
     # Return the list of hyperlinks that are within the same domain
     return list(set(clean_links))
 
 
-def crawl(url):
-    """A method to crawal website and generate text files of each page
+class HostRateLimiter:
+    """A class to space out requests to the same host"""
+
+    def __init__(self, requests_per_second) -> None:
+        """A class constructor
+
+        Args:
+            requests_per_second (float): Maximum requests per second to one host
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        # Longer intervals of hosts asking for it, e.g. by robots.txt Crawl-delay
+        self.host_intervals = {}
+        self.next_request_time = {}
+        self.lock = threading.Lock()
+
+    def set_min_interval(self, host, interval):
+        """A method to make requests to a host at least interval seconds apart
+
+        Args:
+            host (str): Host name
+            interval (float): Minimum seconds between requests
+        """
+        with self.lock:
+            self.host_intervals[host] = max(self.interval, interval)
+
+    def wait(self, host):
+        """A method to block until a request to host is allowed
+
+        Args:
+            host (str): Host name
+        """
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time.get(host, now))
+            interval = self.host_intervals.get(host, self.interval)
+            self.next_request_time[host] = request_time + interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+# Every crawler thread keeps its own session, so connections are reused
+_thread_data = threading.local()
+
+
+def get_session():
+    """A method to get HTTP session of the current thread
+
+    Returns:
+        requests.Session: A session with connection pooling
+    """
+    session = getattr(_thread_data, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers["User-Agent"] = USER_AGENT
+        _thread_data.session = session
+    return session
+
+
+class Page:
+    """A class to hold result of downloading a page"""
+
+    def __init__(
+        self,
+        url,
+        text=None,
+        hyperlinks=None,
+        etag=None,
+        last_modified=None,
+        not_modified=False,
+        gone=False,
+    ) -> None:
+        """A class constructor
+
+        Args:
+            url (str): A page URL
+            text (str, optional): Page text, None if download failed. Defaults to None.
+            hyperlinks (list, optional): Hyperlinks on the page. Defaults to None.
+            etag (str, optional): ETag response header. Defaults to None.
+            last_modified (str, optional): Last-Modified response header. Defaults to None.
+            not_modified (bool, optional): Server answered 304 Not Modified. Defaults to False.
+            gone (bool, optional): Server answered 404 Not Found or 410 Gone. Defaults to False.
+        """
+        self.url = url
+        self.text = text
+        self.hyperlinks = hyperlinks or []
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+        self.gone = gone
+
+
+def fetch_page(
+    url,
+    rate_limiter,
+    timeout,
+    validators=None,
+    max_bytes=0,
+    content_types=("text/html",),
+):
+    """A method to download a page once and get its text and hyperlinks
+
+    Headers are checked before the body is downloaded, so error responses,
+    responses of other content types(PDF, images, archives) or larger than
+    max_bytes are skipped.
+
+    Args:
+        url (str): A page URL
+        rate_limiter (HostRateLimiter): Per host rate limiter
+        timeout (float): Request timeout in seconds
+        validators (dict, optional): etag and last_modified of previous crawl for a conditional request. Defaults to None.
+        max_bytes (int, optional): Maximum response size, 0 for no limit. Defaults to 0.
+        content_types (tuple, optional): Content types to download. Defaults to HTML only.
+
+    Returns:
+        Page: Downloaded page
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    rate_limiter.wait(urlparse(url).netloc)
+    try:
+        with get_session().get(
+            url, timeout=timeout, headers=headers, stream=True
+        ) as response:
+            if response.status_code == 304:
+                return Page(url, not_modified=True)
+            if response.status_code in GONE_STATUS_CODES:
+                return Page(url, gone=True)
+
+            # Error pages are not page content and their links are not followed
+            if not 200 <= response.status_code < 300:
+                print(
+                    "Skipping "
+                    + url
+                    + " with status "
+                    + str(response.status_code)
+                )
+                return Page(url)
+
+            content_type = response.headers.get("Content-Type", "")
+            if content_type and not content_type.startswith(content_types):
+                print("Skipping " + url + " of type " + content_type)
+                return Page(url)
+
+            body = read_body(response, max_bytes)
+            if body is None:
+                print(
+                    "Skipping "
+                    + url
+                    + " larger than "
+                    + str(max_bytes)
+                    + " bytes"
+                )
+                return Page(url)
+            html = body.decode(response.encoding or "utf-8", errors="replace")
+    except Exception as e:
+        print(e)
+        return Page(url)
+
+    # Get the text from the URL using BeautifulSoup and remove the tags
+    text = BeautifulSoup(html, "html.parser").get_text()
+
+    # Only HTML pages have hyperlinks to follow
+    hyperlinks = []
+    if content_type.startswith("text/html"):
+        hyperlinks = parse_hyperlinks(html)
+    return Page(
+        url,
+        text=text,
+        hyperlinks=hyperlinks,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+
+
+class CrawlBudget:
+    """A class to bound number of pages, link depth and duration of a crawl"""
+
+    def __init__(self, max_pages=0, max_depth=0, max_seconds=0) -> None:
+        """A class constructor
+
+        Args:
+            max_pages (int, optional): Maximum pages requested, 0 for no limit. Defaults to 0.
+            max_depth (int, optional): Maximum links followed from the start page, 0 for no limit. Defaults to 0.
+            max_seconds (float, optional): Seconds after which no more pages are requested, 0 for no limit. Defaults to 0.
+        """
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.max_seconds = max_seconds
+        self.pages = 0
+        self.start = time.monotonic()
+        # True once a limit prevented a page from being requested
+        self.exhausted = False
+
+    def allows_depth(self, depth):
+        """A method to check if a new page at a depth is requested
+
+        Args:
+            depth (int): Links followed from start page to the page
+
+        Returns:
+            bool: True if the page is within max_depth
+        """
+        if self.max_depth and depth > self.max_depth:
+            self.exhausted = True
+            return False
+        return True
+
+    def take_page(self):
+        """A method to count a page about to be requested
+
+        Returns:
+            bool: False if page or time limit is reached
+        """
+        if (self.max_pages and self.pages >= self.max_pages) or (
+            self.max_seconds
+            and time.monotonic() - self.start >= self.max_seconds
+        ):
+            self.exhausted = True
+            return False
+        self.pages += 1
+        return True
+
+    @classmethod
+    def from_config(cls):
+        """A method to create budget of crawler_max_pages, crawler_max_depth and crawler_max_seconds
+
+        Returns:
+            CrawlBudget: Budget of a crawl
+        """
+        return cls(
+            int(config.get(constants.CRAWLER_MAX_PAGES)),
+            int(config.get(constants.CRAWLER_MAX_DEPTH)),
+            float(config.get(constants.CRAWLER_MAX_SECONDS)),
+        )
+
+
+class CrawlState:
+    """A class to keep validators and links of every crawled page of a website
+
+    State is saved in crawl_state.json next to website embeddings and is used
+    to send conditional requests and find changed pages on the next crawl.
+    """
+
+    def __init__(self, local_domain) -> None:
+        """A class constructor
+
+        Args:
+            local_domain (str): only domain name of URL
+        """
+        self.path = (
+            config.get(constants.EMBEDDINGS_DATA_PATH)
+            + local_domain
+            + "/crawl_state.json"
+        )
+        self.pages = {}
+
+    def load(self):
+        """A method to load state of previous crawl, if any
+
+        Returns:
+            CrawlState: self
+        """
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="UTF-8") as f:
+                self.pages = json.load(f)
+        return self
+
+    def save(self):
+        """A method to save state of the crawl"""
+        with open(self.path + ".tmp", "w", encoding="UTF-8") as f:
+            json.dump(self.pages, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class CrawlResult:
+    """A class to hold text files changed by a crawl"""
+
+    def __init__(self, changed, removed) -> None:
+        """A class constructor
+
+        Args:
+            changed (list): Text file names of new or modified pages
+            removed (list): Text file names of pages no longer found
+        """
+        self.changed = changed
+        self.removed = removed
+
+
+def page_file_name(url):
+    """A method to get text file name of a page URL
+
+    Args:
+        url (str): A page URL
+
+    Returns:
+        str: A file name without extension
+    """
+    return remove_unicode(url[8:])
+
+
+def save_page_text(local_domain, file_name, text):
+    """A method to save text of a page to a <file_name>.txt file
+
+    Args:
+        local_domain (str): only domain name of URL
+        file_name (str): Text file name of the page, see page_file_name
+        text (str): Page text
+    """
+    with open(
+        config.get(constants.TEXT_DATA_PATH)
+        + local_domain
+        + "/"
+        + file_name
+        + ".txt",
+        "w",
+        encoding="UTF-8",
+    ) as f:
+        f.write(text)
+
+
+def iter_pages(url, incremental=False, on_page=None, result=None):
+    """A generator to crawl website and yield text of new or modified pages
+
+    Pages are downloaded by a pool of crawler_workers threads, with at most
+    crawler_requests_per_second requests to a host. In incremental mode pages
+    of the previous crawl are requested with their ETag/Last-Modified and only
+    pages whose content hash changed are yielded. At most two pages per worker
+    are downloaded ahead of the consumer, so a slow consumer holds the crawl
+    back instead of buffering the website in memory. Links are canonicalized
+    and the crawl stops at crawler_max_pages, crawler_max_depth or
+    crawler_max_seconds.
+
+    robots.txt disallow rules and Crawl-delay are respected. Pages listed in
+    sitemaps are added before crawling starts and pages are downloaded in
+    order of sitemap priority and freshness, then link depth.
 
     Args:
         url (str): A complete website URL
+        incremental (bool, optional): Refresh result of previous crawl. Defaults to False.
+        on_page (callable, optional): Called with URL of every crawled page. Defaults to None.
+        result (CrawlResult, optional): Filled with changed and removed text file names. Defaults to None.
+
+    Yields:
+        tuple: Text file name and text of a new or modified page
     """
     # Parse the URL and get the domain
     local_domain = urlparse(url).netloc
 
-    # Create a queue to store the URLs to crawl
-    queue = deque([url])
-
     # Create a set to store the URLs that have already been seen (no duplicates)
-    seen = set([url])
+    seen = set([url, canonicalize_url(url)])
 
     # Create a directory to store the text files
     if not os.path.exists(
@@ -142,47 +524,196 @@ def crawl(url):
             config.get(constants.EMBEDDINGS_DATA_PATH) + local_domain + "/"
         )
 
-    # While the queue is not empty, continue crawling
-    while queue:
-        # Get the next URL from the queue
-        url = queue.pop()
-        print(url)  # for debugging and to see the progress
-
-        # Save text from the url to a <url>.txt file
-        file_name = remove_unicode(url[8:])
-        """with open(
-            "text/" + local_domain + "/" + url[8:].replace("/", "_") + ".txt",
-            "w",
-            encoding="UTF-8",
-        ) as f:"""
-        with open(
-            config.get(constants.TEXT_DATA_PATH)
-            + local_domain
-            + "/"
-            + file_name
-            + ".txt",
-            "w",
-            encoding="UTF-8",
-        ) as f:
-            # Get the text from the URL using BeautifulSoup
-            soup = BeautifulSoup(requests.get(url).text, "html.parser")
-
-            # Get the text but remove the tags
-            text = soup.get_text()
-
-            # If the crawler gets to a page that requires JavaScript, it will stop the crawl
-            if "You need to enable JavaScript to run this app." in text:
-                print(
-                    "Unable to parse page "
-                    + url
-                    + " due to JavaScript being required"
-                )
+    previous = CrawlState(local_domain)
+    if incremental:
+        previous.load()
+    state = CrawlState(local_domain)
+    if result is None:
+        result = CrawlResult([], [])
+
+    rate_limiter = HostRateLimiter(
+        float(config.get(constants.CRAWLER_REQUESTS_PER_SECOND))
+    )
+    timeout = float(config.get(constants.CRAWLER_TIMEOUT))
+    workers = int(config.get(constants.CRAWLER_WORKERS))
+    max_bytes = int(
+        float(config.get(constants.CRAWLER_MAX_RESPONSE_MB)) * 1024 * 1024
+    )
+    content_types = config.get(constants.CRAWLER_CONTENT_TYPES).split(",")
+    content_types = tuple(
+        content_type.strip() for content_type in content_types
+    )
+    budget = CrawlBudget.from_config()
+
+    # Links waiting to be downloaded, best scored first
+    frontier = CrawlFrontier()
+    # Pages the server reports as removed
+    gone = set()
+    root_url = urlparse(url).scheme + "://" + local_domain
+    robots = None
+    if config.get(constants.CRAWLER_RESPECT_ROBOTS) == "true":
+        rate_limiter.wait(local_domain)
+        robots = load_robots(root_url, get_session(), timeout)
+        crawl_delay = robots.crawl_delay(USER_AGENT)
+        if crawl_delay:
+            rate_limiter.set_min_interval(local_domain, float(crawl_delay))
+
+    def allowed(link):
+        return robots is None or robots.can_fetch(USER_AGENT, link)
+
+    # Pages listed in sitemaps are known before the first page is downloaded
+    if config.get(constants.CRAWLER_USE_SITEMAPS) == "true":
+        sitemap_urls = robots.site_maps() if robots is not None else None
+        for loc, lastmod, priority in iter_sitemap_pages(
+            sitemap_urls or [root_url + "/sitemap.xml"],
+            get_session(),
+            timeout,
+            int(config.get(constants.CRAWLER_MAX_SITEMAPS)),
+            wait=rate_limiter.wait,
+            max_bytes=max_bytes,
+        ):
+            if budget.max_pages and len(frontier) >= budget.max_pages:
+                break
+            if urlparse(loc).netloc.lower() != local_domain.lower():
+                continue
+            link = canonicalize_url(loc)
+            if link not in seen and allowed(link):
+                seen.add(link)
+                frontier.push(link, 1, sitemap_score(priority, lastmod))
+
+    def submit(executor, link):
+        return executor.submit(
+            fetch_page,
+            link,
+            rate_limiter,
+            timeout,
+            previous.pages.get(link),
+            max_bytes,
+            content_types,
+        )
 
-            # Otherwise, write the text to the file in the text directory
-            f.write(text)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Pages being downloaded, continue crawling until there are none left
+        pending = {}
+        if allowed(url):
+            budget.take_page()
+            pending[submit(executor, url)] = (url, 0)
+        else:
+            print("Crawling " + url + " is disallowed by robots.txt")
+        while pending or frontier:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, depth = pending.pop(future)
+                print(url)  # for debugging and to see the progress
+                page = future.result()
+                old = previous.pages.get(url)
+                if on_page is not None:
+                    on_page(url)
+
+                if page.gone:
+                    gone.add(url)
+                    continue
+                if page.text is None:
+                    # Unchanged or temporarily failing pages keep their previous text
+                    if old is not None:
+                        state.pages[url] = old
+                        hyperlinks = old["links"]
+                    else:
+                        continue
+                else:
+                    text = page.text
+                    hyperlinks = page.hyperlinks
+
+                    # If the crawler gets to a page that requires JavaScript, it will stop the crawl
+                    if (
+                        "You need to enable JavaScript to run this app."
+                        in text
+                    ):
+                        print(
+                            "Unable to parse page "
+                            + url
+                            + " due to JavaScript being required"
+                        )
+
+                    file_name = page_file_name(url)
+                    content_hash = hashlib.sha256(
+                        text.encode("UTF-8")
+                    ).hexdigest()
+                    state.pages[url] = {
+                        "etag": page.etag,
+                        "last_modified": page.last_modified,
+                        "content_hash": content_hash,
+                        "file_name": file_name,
+                        "links": hyperlinks,
+                    }
+
+                    # Otherwise, pass the text of new or modified page on
+                    if old is None or old["content_hash"] != content_hash:
+                        result.changed.append(file_name)
+                        yield file_name, text
+
+                # Add the hyperlinks of the page to the pages to download
+                for link in clean_domain_hyperlinks(local_domain, hyperlinks):
+                    if link in seen or not allowed(link):
+                        continue
+                    # Budget is only exhausted if a new page is left out
+                    if not budget.allows_depth(depth + 1):
+                        break
+                    seen.add(link)
+                    frontier.push(link, depth + 1, link_score(depth + 1))
+
+            while frontier and len(pending) < 2 * workers:
+                if not budget.take_page():
+                    frontier.clear()
+                    break
+                link, link_depth = frontier.pop()
+                pending[submit(executor, link)] = (link, link_depth)
+
+    if budget.exhausted:
+        print("Crawl of " + local_domain + " stopped by crawl budget")
+
+    # Pages of previous crawl which are removed or not linked anymore
+    for old_url, old in previous.pages.items():
+        if (
+            old_url not in state.pages
+            and old_url not in gone
+            and budget.exhausted
+        ):
+            # Page may only be beyond the budget, keep it for the next crawl
+            state.pages[old_url] = old
+        elif old_url not in state.pages:
+            result.removed.append(old["file_name"])
+            text_file = (
+                config.get(constants.TEXT_DATA_PATH)
+                + local_domain
+                + "/"
+                + old["file_name"]
+                + ".txt"
+            )
+            if os.path.exists(text_file):
+                os.remove(text_file)
+
+    state.save()
+
+
+def crawl(url, incremental=False, on_page=None):
+    """A method to crawal website and generate text files of each page
 
-        # Get the hyperlinks from the URL and add them to the queue
-        for link in get_domain_hyperlinks(local_domain, url):
-            if link not in seen:
-                queue.append(link)
-                seen.add(link)
+    In incremental mode only text files of new or modified pages are written,
+    see iter_pages.
+
+    Args:
+        url (str): A complete website URL
+        incremental (bool, optional): Refresh result of previous crawl. Defaults to False.
+        on_page (callable, optional): Called with URL of every crawled page. Defaults to None.
+
+    Returns:
+        CrawlResult: Text files written and removed by the crawl
+    """
+    local_domain = urlparse(url).netloc
+    result = CrawlResult([], [])
+    for file_name, text in iter_pages(
+        url, incremental=incremental, on_page=on_page, result=result
+    ):
+        save_page_text(local_domain, file_name, text)
+    return result
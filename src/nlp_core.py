@@ -2,53 +2,199 @@
 """
 
 
-import os
+import threading
 from urllib.parse import urlparse
 from src.chatbot_core.chatbot_response_generator import ChatbotCore
-from src.data_collection import web_crawler
+from src.chatbot_core.answer_cache import answer_cache
+from src.chatbot_core.query_embedding_cache import query_embedding_cache
 from src.data_collection.data_processor import DataProcessor
+from src.data_collection.content_store import content_embedding_store
+from src.data_collection.index_cache import IndexCache
+from src.data_collection.ingestion_jobs import IngestionJobManager, READY
 from src.utility.utils import config
 from src.utility import constants
 from src.utility.loggers import logger
 
 
 class NLPCore:
-    """A core NLP class having methods to generate bot response"""
+    """A core NLP class having methods to generate bot response
+
+    A single instance is shared by all request threads. Every method gets the
+    website of the request, so requests for different websites do not change
+    shared state.
+    """
 
     def __init__(self) -> None:
         """Class constructor"""
-        self.dataset_embeddings = None
-        self.data_processor = None
-        self.full_url = None
-        self.local_domain = None
+        self.data_processors = {}
+        self._lock = threading.Lock()
+        # Loaded website indexes shared by all queries, evicted in LRU order
+        self.index_cache = IndexCache(
+            int(config.get(constants.INDEX_CACHE_MEMORY_MB)) * 1024 * 1024
+        )
+        # Websites are crawled and embedded in background, not inside a request
+        self.ingestion_jobs = IngestionJobManager(
+            int(config.get(constants.INGESTION_WORKERS))
+        )
 
-    def set_website_name(self, website_name):
-        """A method to set website name and initialise data processor to process website texts
+    def get_data_processor(self, website_name):
+        """A method to get data processor of a website, creating it on first use
 
         Args:
             website_name (str): A website name to give a chatbot the context
+
+        Returns:
+            DataProcessor: Data processor of the website
         """
-        if self.full_url != website_name:
-            self.full_url = website_name
-            self.local_domain = urlparse(self.full_url).netloc
-            self.data_processor = DataProcessor(self.full_url)
-        logger.info("Website entered:%s", website_name)
+        with self._lock:
+            data_processor = self.data_processors.get(website_name)
+            if data_processor is None:
+                data_processor = DataProcessor(website_name)
+                self.data_processors[website_name] = data_processor
+        return data_processor
 
-    def core_method(self, question):
+    def core_method(self, question, website_name):
         """A method to generate bot response based on query
 
         Args:
             question (str): A user query
+            website_name (str): A website name to give a chatbot the context
 
         Returns:
             answer (str): A bot response to user query
         """
+        logger.info("Website entered:%s", website_name)
+        local_domain = urlparse(website_name).netloc
+        data_processor = self.get_data_processor(website_name)
+
+        answer = self.indexing_message(website_name)
+        if answer is not None:
+            logger.info("User Query: " + question)
+            logger.info("Chatbot Response: " + answer)
+            return answer
 
+        index = self.index_cache.get(
+            local_domain,
+            data_processor.get_embeddings,
+            data_processor.store.current_version,
+        )
         answer = ChatbotCore().answer_question(
-            self.data_processor.get_embeddings(),
+            index,
             question=question,
             debug=True,
         )
         logger.info("User Query: " + question)
         logger.info("Chatbot Response: " + answer)
         return answer
+
+    def stream_method(self, question, website_name):
+        """A method to generate bot response piece by piece based on query
+
+        Args:
+            question (str): A user query
+            website_name (str): A website name to give a chatbot the context
+
+        Yields:
+            str: Next piece of bot response to user query
+        """
+        logger.info("Website entered:%s", website_name)
+        logger.info("User Query: " + question)
+        answer = self.indexing_message(website_name)
+        if answer is not None:
+            yield answer
+            return
+
+        data_processor = self.get_data_processor(website_name)
+        index = self.index_cache.get(
+            urlparse(website_name).netloc,
+            data_processor.get_embeddings,
+            data_processor.store.current_version,
+        )
+        yield from ChatbotCore().stream_answer(index, question=question)
+
+    def indexing_message(self, website_name):
+        """A method to start indexing of a website which is not ready yet
+
+        Args:
+            website_name (str): A website name
+
+        Returns:
+            str: A bot response with indexing progress, None if website is ready
+        """
+        job = self.ingestion_jobs.get(urlparse(website_name).netloc)
+        if (job is None or job.done) and self.is_indexed(website_name):
+            return None
+        job = self.start_indexing(website_name)
+        return (
+            "I am still reading this website("
+            + str(job.pages_crawled)
+            + " pages crawled, "
+            + str(job.chunks_embedded)
+            + " text chunks processed). Please ask again in a moment."
+        )
+
+    def is_indexed(self, website_name):
+        """A method to check if index of a website is ready to be queried
+
+        Args:
+            website_name (str): A website name
+
+        Returns:
+            bool: True if index is loaded or stored
+        """
+        return (
+            self.index_cache.contains(urlparse(website_name).netloc)
+            or self.get_data_processor(website_name).store.exists()
+        )
+
+    def start_indexing(self, website_name):
+        """A method to start background indexing of a website
+
+        A website which is already being indexed is not submitted again.
+
+        Args:
+            website_name (str): A website name
+
+        Returns:
+            IngestionJob: Indexing job of the website
+        """
+        return self.ingestion_jobs.submit(
+            urlparse(website_name).netloc,
+            website_name,
+            self.get_data_processor(website_name).get_embeddings,
+        )
+
+    def indexing_status(self, website_name):
+        """A method to get indexing status and progress of a website
+
+        Args:
+            website_name (str): A website name
+
+        Returns:
+            dict: Job status, or ready/not_indexed status if there is no running job
+        """
+        job = self.ingestion_jobs.get(urlparse(website_name).netloc)
+        indexed = self.is_indexed(website_name)
+        if job is not None and (not job.done or not indexed):
+            return job.to_dict()
+        return {
+            "website": website_name,
+            "status": READY if indexed else "not_indexed",
+        }
+
+    def cache_stats(self):
+        """A method to get counters of index, embedding and answer caches
+
+        Returns:
+            dict: Cache statistics
+        """
+        return {
+            "index_cache": self.index_cache.stats(),
+            "query_embedding_cache": query_embedding_cache.stats(),
+            "answer_cache": answer_cache.stats(),
+            "chunk_embedding_store": (
+                content_embedding_store.stats()
+                if content_embedding_store is not None
+                else None
+            ),
+        }
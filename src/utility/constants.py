@@ -15,3 +15,50 @@ TEXT_DATA_PATH = "text_data_path"
 EMBEDDINGS_DATA_PATH = "embeddings_data_path"
 CHAT_MODEL = "chat_model"
 OPENAI_API_KEY = "openai_api_key"
+INDEX_CACHE_MEMORY_MB = "index_cache_memory_mb"
+ANN_MIN_CHUNKS = "ann_min_chunks"
+ANN_NLIST = "ann_nlist"
+ANN_NPROBE = "ann_nprobe"
+EMBEDDING_BATCH_TOKENS = "embedding_batch_tokens"
+EMBEDDING_BATCH_SIZE = "embedding_batch_size"
+EMBEDDING_WORKERS = "embedding_workers"
+CRAWLER_WORKERS = "crawler_workers"
+CRAWLER_REQUESTS_PER_SECOND = "crawler_requests_per_second"
+CRAWLER_TIMEOUT = "crawler_timeout"
+QUERY_CACHE_SIZE = "query_cache_size"
+QUERY_CACHE_TTL = "query_cache_ttl"
+QUERY_CACHE_PATH = "query_cache_path"
+QUERY_CACHE_DISK_SIZE = "query_cache_disk_size"
+ANSWER_CACHE_WEBSITES = "answer_cache_websites"
+ANSWER_CACHE_THRESHOLD = "answer_cache_threshold"
+ANSWER_CACHE_SIZE = "answer_cache_size"
+ANSWER_CACHE_DOMAINS = "answer_cache_domains"
+INGESTION_WORKERS = "ingestion_workers"
+ROUTE_RETRIEVAL_THRESHOLD = "route_retrieval_threshold"
+ROUTE_SPECULATIVE = "route_speculative"
+ROUTE_WORKERS = "route_workers"
+CHUNKING_WORKERS = "chunking_workers"
+PIPELINE_QUEUE_SIZE = "pipeline_queue_size"
+KEEP_INTERMEDIATE_FILES = "keep_intermediate_files"
+EMBEDDING_STORE_PATH = "embedding_store_path"
+EMBEDDING_STORE_MAX_ENTRIES = "embedding_store_max_entries"
+BOILERPLATE_THRESHOLD = "boilerplate_threshold"
+BOILERPLATE_MIN_PAGES = "boilerplate_min_pages"
+BOILERPLATE_SAMPLE_PAGES = "boilerplate_sample_pages"
+NEAR_DUPLICATE_THRESHOLD = "near_duplicate_threshold"
+NEAR_DUPLICATE_NUM_PERM = "near_duplicate_num_perm"
+CRAWLER_MAX_PAGES = "crawler_max_pages"
+CRAWLER_MAX_DEPTH = "crawler_max_depth"
+CRAWLER_MAX_SECONDS = "crawler_max_seconds"
+CRAWLER_MAX_RESPONSE_MB = "crawler_max_response_mb"
+CRAWLER_CONTENT_TYPES = "crawler_content_types"
+CRAWLER_RESPECT_ROBOTS = "crawler_respect_robots"
+CRAWLER_USE_SITEMAPS = "crawler_use_sitemaps"
+CRAWLER_MAX_SITEMAPS = "crawler_max_sitemaps"
+VECTOR_QUANTIZATION = "vector_quantization"
+QUANTIZATION_RESCORE = "quantization_rescore"
+VECTOR_PROJECTION_DIMENSIONS = "vector_projection_dimensions"
+PROJECTION_RESCORE = "projection_rescore"
+RETRIEVAL_MODE = "retrieval_mode"
+PAGE_INDEX_MIN_PAGES = "page_index_min_pages"
+PAGE_NPROBE = "page_nprobe"
@@ -4,6 +4,7 @@ import re
 import string
 import html
 import itertools
+import functools
 
 import nltk
 import nltk.corpus
@@ -17,6 +18,9 @@ from autocorrect import Speller
 from langdetect import detect
 
 
+# Runs of letters and digits, without underscores
+TERM_PATTERN = re.compile(r"[^\W_]+")
+
 # intialize stopwords
 nltk.download("stopwords")
 # NLTK POS tagger
@@ -177,6 +181,39 @@ def correct_grammar(text):
     return text
 
 
+@functools.lru_cache(maxsize=None)
+def get_stopwords(language="english"):
+    """A method to get stopwords of a language, loaded once
+
+    Args:
+        language (str, optional): Language name. Defaults to "english".
+
+    Returns:
+        frozenset: Stopwords
+    """
+
+    return frozenset(stopwords.words(language))
+
+
+def split_into_terms(text):
+    """A method to split text into lower case words without punctuation and stopwords
+
+    Args:
+        text (str): text data
+
+    Returns:
+        list: list of words
+    """
+
+    stop = get_stopwords()
+    # Letters and digits of any script, so websites in other languages get terms too
+    return [
+        word
+        for word in TERM_PATTERN.findall(lower_case_text(text))
+        if word not in stop
+    ]
+
+
 def remove_stopwrods(text):
     """A method to remove stopwords from text
 